@@ -8,7 +8,7 @@ DELAY = 0.001
 
 
 def main():
-    with PerfectSocket() as ps:
+    with PerfectSocket(trace_latency=True) as ps:
         for i in range(1001):
             data = f"packet {i} sent at {time.time()}".encode("utf-8")
             ps.sendto(data, (DST_IP, DST_PORT))
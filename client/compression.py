@@ -0,0 +1,317 @@
+import functools
+import logging
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec ids, low 4 bits of the first byte of a compressed payload
+CODEC_ZLIB = 1  # Raw deflate
+CODEC_LZ4 = 2  # lz4 block, uncompressed size first
+CODEC_ZSTD = 3  # zstd frame
+CODEC_MASK = 0x0F
+CODECS = {"zlib": CODEC_ZLIB, "lz4": CODEC_LZ4, "zstd": CODEC_ZSTD}
+
+# Flag, high bits of the codec byte: followed by DICT_ID of the shared dictionary
+CODEC_FLAG_DICT = 0x80
+DICT_ID = struct.Struct(">I")
+
+# Max size a received payload may decompress to
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+
+
+def available_codecs():
+    """
+    Return the names of the codecs usable in this process, zlib is always available.
+    """
+    codecs = ["zlib"]
+    if lz4:
+        codecs.append("lz4")
+    if zstandard:
+        codecs.append("zstd")
+    return codecs
+
+
+def build_dictionary(samples, size=16 * 1024):
+    """
+    Build a raw content dictionary from sample messages, usable by every codec.
+
+    The codecs find matches closer to the end of the dictionary cheaper, so
+    the most recent samples go last.
+
+    Args:
+        samples (list): Sample messages (bytes), oldest first.
+        size (int): Max dictionary size in bytes.
+
+    Returns:
+        bytes: The dictionary.
+    """
+    seen = set()
+    parts = []
+    total = 0
+    for sample in reversed(samples):
+        if sample in seen:
+            continue
+        seen.add(sample)
+        parts.append(sample)
+        total += len(sample)
+        if total >= size:
+            break
+    return b"".join(reversed(parts))[-size:]
+
+
+def _dict_id(dictionary):
+    """
+    Identify a dictionary in compressed payloads.
+    """
+    return zlib.crc32(dictionary)
+
+
+@functools.lru_cache(maxsize=8)
+def _zstd_dict(dictionary):
+    """
+    Load a dictionary for zstd once.
+    """
+    return zstandard.ZstdCompressionDict(dictionary)
+
+
+def decompress(payload, dictionary=None, max_size=MAX_DECOMPRESSED_SIZE):
+    """
+    Decompress a payload produced by Compressor.compress.
+
+    Args:
+        payload (bytes): Codec byte, optional DICT_ID and compressed data.
+        dictionary (bytes): Shared dictionary the sender may have used.
+        max_size (int): Max decompressed size, larger payloads are refused.
+
+    Returns:
+        bytes: The original data.
+
+    Raises:
+        ValueError: Unknown codec or dictionary, codec not installed, or payload too large.
+    """
+    if not payload:
+        raise ValueError("compression: empty payload.")
+    codec, flags = payload[0] & CODEC_MASK, payload[0] & ~CODEC_MASK
+    offset = 1
+    zdict = None
+    if flags & CODEC_FLAG_DICT:
+        (dict_id,) = DICT_ID.unpack_from(payload, offset)
+        offset += DICT_ID.size
+        if dictionary is None or _dict_id(dictionary) != dict_id:
+            raise ValueError(f"compression: unknown dictionary {dict_id:#010x}.")
+        zdict = dictionary
+    data = memoryview(payload)[offset:]
+
+    if codec == CODEC_ZLIB:
+        d = zlib.decompressobj(-15, zdict=zdict) if zdict else zlib.decompressobj(-15)
+        result = d.decompress(data, max_size)
+        if d.unconsumed_tail or not d.eof:
+            raise ValueError("compression: truncated or oversized zlib payload.")
+        return result
+    if codec == CODEC_LZ4:
+        if lz4 is None:
+            raise ValueError("compression: lz4 payload but lz4 is not installed.")
+        if len(data) < 4 or int.from_bytes(data[:4], "little") > max_size:
+            raise ValueError("compression: truncated or oversized lz4 payload.")
+        if zdict:
+            return lz4.block.decompress(data, dict=zdict)
+        return lz4.block.decompress(data)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError(
+                "compression: zstd payload but zstandard is not installed."
+            )
+        size = zstandard.frame_content_size(data)
+        if size < 0 or size > max_size:
+            raise ValueError("compression: unknown or oversized zstd content size.")
+        dict_data = _zstd_dict(zdict) if zdict else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data)
+    raise ValueError(f"compression: unknown codec {codec}.")
+
+
+class Compressor:
+    """
+    Compression stage of a stream, run on each message before FEC encoding.
+
+    Compressed messages need fewer (or smaller) fragments, so less to encode,
+    send and decode. The compressor measures what it saves on a window of
+    probe_count messages and bypasses itself for bypass_count messages when
+    the savings don't pay for the CPU (below min_savings of the bytes, or
+    below min_saved_rate bytes saved per second of compression), then probes
+    again.
+
+    With a shared dictionary (the same bytes on both ends, see
+    build_dictionary), small repetitive messages compress too.
+    """
+
+    def __init__(
+        self,
+        codec="zlib",
+        level=None,
+        dictionary=None,
+        min_size=32,
+        min_savings=0.1,
+        min_saved_rate=1_000_000,
+        probe_count=16,
+        bypass_count=256,
+    ):
+        """
+        Initialize Compressor.
+
+        Args:
+            codec (str): "zlib", "lz4" or "zstd", the receiver needs the codec installed too.
+            level (int): Codec compression level, None for a fast level.
+            dictionary (bytes): Shared dictionary, the receiving stream needs the same one.
+            min_size (int): Messages shorter than this are sent as they are.
+            min_savings (float): Min fraction of the bytes compression must save to stay on.
+            min_saved_rate (float): Min bytes saved per second of compression to stay on.
+            probe_count (int): Number of compressed messages the savings are measured on.
+            bypass_count (int): Number of messages sent uncompressed before probing again.
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Compressor: unknown codec {codec!r}.")
+        if codec not in available_codecs():
+            raise ValueError(f"Compressor: codec {codec!r} is not installed.")
+        self.codec = codec
+        self.level = level
+        self.dictionary = dictionary or None
+        self.min_size = min_size
+        self.min_savings = min_savings
+        self.min_saved_rate = min_saved_rate
+        self.probe_count = max(1, probe_count)
+        self.bypass_count = bypass_count
+
+        self._prefix = bytes([CODECS[codec]])
+        if self.dictionary:
+            self._prefix = bytes([CODECS[codec] | CODEC_FLAG_DICT]) + DICT_ID.pack(
+                _dict_id(self.dictionary)
+            )
+        if codec == "zlib" and level is None:
+            self.level = 1
+        self._lz4_args = {}
+        if codec == "lz4" and level is not None:
+            self._lz4_args = {"mode": "high_compression", "compression": level}
+        if self.dictionary and codec == "lz4":
+            self._lz4_args["dict"] = self.dictionary
+        self._local = threading.local()  # zstd compressors aren't thread-safe
+
+        self._lock = threading.Lock()
+        self._bypass = 0  # Messages left to send uncompressed
+        self._window = [0, 0, 0.0]  # Bytes in, bytes out, seconds of the probe window
+        self._window_count = 0
+
+        # Statistics
+        self.stat_compressed = 0
+        self.stat_bypassed = 0
+        self.stat_bytes_in = 0
+        self.stat_bytes_out = 0
+        self.stat_bypass_switches = 0
+
+    def compress(self, data):
+        """
+        Compress a message if it pays.
+
+        Returns:
+            bytes: The compressed payload (see decompress), None to send data as it is.
+        """
+        if len(data) < self.min_size:
+            return None
+        with self._lock:
+            if self._bypass:
+                self._bypass -= 1
+                self.stat_bypassed += 1
+                return None
+        start = time.perf_counter()
+        payload = self._prefix + self._compress(data)
+        elapsed = time.perf_counter() - start
+        size = min(len(payload), len(data))
+        with self._lock:
+            self.stat_bytes_in += len(data)
+            self.stat_bytes_out += size
+            window = self._window
+            window[0] += len(data)
+            window[1] += size
+            window[2] += elapsed
+            self._window_count += 1
+            if self._window_count >= self.probe_count:
+                self._check_window()
+        if len(payload) >= len(data):
+            return None
+        self.stat_compressed += 1
+        return payload
+
+    def decompress(self, payload):
+        """
+        Decompress a payload received on the stream.
+        """
+        return decompress(payload, self.dictionary)
+
+    def stats(self):
+        """
+        Return the compression statistics as a dict.
+        """
+        return {
+            "codec": self.codec,
+            "compressed": self.stat_compressed,
+            "bypassed": self.stat_bypassed,
+            "bytes_in": self.stat_bytes_in,
+            "bytes_out": self.stat_bytes_out,
+            "bypass_switches": self.stat_bypass_switches,
+            "active": not self._bypass,
+        }
+
+    def _check_window(self):
+        """
+        Bypass compression when the probe window savings don't pay, called with the lock held.
+        """
+        bytes_in, bytes_out, seconds = self._window
+        saved = bytes_in - bytes_out
+        self._window = [0, 0, 0.0]
+        self._window_count = 0
+        if (
+            saved >= self.min_savings * bytes_in
+            and saved >= self.min_saved_rate * seconds
+        ):
+            return
+        self._bypass = self.bypass_count
+        self.stat_bypass_switches += 1
+        logging.debug(
+            f"Compressor: {self.codec} saved {saved}/{bytes_in} bytes in "
+            f"{seconds * 1000:.2f}ms, bypassed for {self.bypass_count} messages"
+        )
+
+    def _compress(self, data):
+        """
+        Compress data with the codec, without the payload prefix.
+        """
+        if self.codec == "zlib":
+            # Size the window and hash table to the message, setting up the
+            # default 32 KB window costs more than compressing small messages
+            dict_size = len(self.dictionary) if self.dictionary else 0
+            wbits = min(15, max(9, (len(data) + dict_size).bit_length()))
+            args = (self.level, zlib.DEFLATED, -wbits, max(1, wbits - 7))
+            if self.dictionary:
+                c = zlib.compressobj(*args, zdict=self.dictionary)
+            else:
+                c = zlib.compressobj(*args)
+            return c.compress(data) + c.flush()
+        if self.codec == "lz4":
+            return lz4.block.compress(data, **self._lz4_args)
+        compressor = getattr(self._local, "zstd", None)
+        if compressor is None:
+            compressor = self._local.zstd = zstandard.ZstdCompressor(
+                level=3 if self.level is None else self.level,
+                dict_data=_zstd_dict(self.dictionary) if self.dictionary else None,
+                write_content_size=True,
+            )
+        return compressor.compress(data)
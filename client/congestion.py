@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+
+# Max seconds of sending time a late paced sender may catch up on
+PACE_SLACK = 0.002
+
+
+class AimdController:
+    """
+    Loss-based AIMD congestion controller fed by receiver feedback reports.
+
+    Batches that could not be decoded are always a congestion signal. Loss
+    that FEC repaired only is once it uses more than fec_margin of the FEC
+    headroom, the share of parity fragments in the batches sent since the
+    previous report (1 - 1/redundancy_ratio), or more than loss_tolerance
+    if set. Whole batches lost on a drop-tail queue are neither repaired
+    nor unrecovered until they expire, so the loss rate is what reacts
+    first, the repaired count is only logged. The rate doubles per report
+    until the first congestion event (slow start), then grows additively.
+    """
+
+    def __init__(
+        self,
+        initial_rate=1_000_000,
+        min_rate=50_000,
+        max_rate=1_000_000_000,
+        increase=100_000,
+        decrease=0.7,
+        loss_tolerance=None,
+        fec_margin=0.5,
+        max_queue_delay=0.2,
+        clock=None,
+    ):
+        """
+        Initialize AimdController.
+
+        Args:
+            initial_rate (float): Initial pacing rate (bytes/sec).
+            min_rate (float): Min pacing rate (bytes/sec).
+            max_rate (float): Max pacing rate (bytes/sec).
+            increase (float): Additive increase per report without congestion (bytes/sec).
+            decrease (float): Multiplicative decrease factor on congestion.
+            loss_tolerance (float): Fragment loss rate FEC repaired tolerated before it counts as congestion, None to derive it from the FEC headroom.
+            fec_margin (float): Fraction of the FEC headroom repaired loss may use before it counts as congestion.
+            max_queue_delay (float): Max seconds of data at the current rate admitted to the send queue.
+            clock (object): Time source with the time module interface, None for the time module.
+        """
+        self.rate = float(initial_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.loss_tolerance = loss_tolerance
+        self.fec_margin = fec_margin
+        self.max_queue_delay = max_queue_delay
+        self.slow_start = True
+        self._clock = clock or time
+
+        self._lock = threading.Lock()
+        self._pace_next = 0.0
+        self._sent_bytes = 0  # Sent since the last report
+        # Primary and total fragments of the batches sent since the last report
+        self._sent_k = 0
+        self._sent_n = 0
+        self._fec_headroom = 0.5  # Share of parity fragments, redundancy 2 until known
+        self._last_report = None  # Previous cumulative counters
+        self._last_report_time = None
+
+        # Statistics
+        self.stat_reports = 0
+        self.stat_congestion = 0
+
+    def pace(self, size):
+        """
+        Ask to send a packet of size bytes at the current rate, without blocking.
+
+        Returns:
+            float: 0 if the packet may be sent now (it is accounted for), otherwise seconds to wait before asking again.
+        """
+        with self._lock:
+            now = self._clock.monotonic()
+            if self._pace_next > now:
+                return self._pace_next - now
+            # Make up for a late wake up, up to PACE_SLACK
+            self._pace_next = max(self._pace_next, now - PACE_SLACK) + size / self.rate
+            self._sent_bytes += size
+            return 0
+
+    def on_batch_sent(self, k, n):
+        """
+        Account for the FEC parameters of a batch sent.
+        """
+        with self._lock:
+            self._sent_k += k
+            self._sent_n += n
+
+    def admit(self, queued_bytes):
+        """
+        Check whether the send queue may take more data.
+        """
+        return queued_bytes <= self.rate * self.max_queue_delay
+
+    def on_report(self, received, lost, repaired, unrecovered):
+        """
+        Update the rate from a receiver report.
+
+        Args:
+            received (int): Cumulative number of fragments received.
+            lost (int): Cumulative number of fragments lost.
+            repaired (int): Cumulative number of batches decoded despite lost fragments.
+            unrecovered (int): Cumulative number of batches that could not be decoded.
+        """
+        counters = (received, lost, repaired, unrecovered)
+        now = self._clock.monotonic()
+        with self._lock:
+            previous, self._last_report = self._last_report, counters
+            last_time, self._last_report_time = self._last_report_time, now
+            sent_bytes, self._sent_bytes = self._sent_bytes, 0
+            if self._sent_n:
+                self._fec_headroom = 1 - self._sent_k / self._sent_n
+                self._sent_k = self._sent_n = 0
+            if previous is None:
+                return
+            # Counters are cumulative and wrap at 32 bits, so lost reports lose nothing
+            d_received, d_lost, d_repaired, d_unrecovered = (
+                (c - p) & 0xFFFFFFFF for c, p in zip(counters, previous)
+            )
+            self.stat_reports += 1
+            total = d_received + d_lost
+            loss_rate = d_lost / total if total else 0.0
+            tolerance = self.loss_tolerance
+            if tolerance is None:
+                tolerance = self.fec_margin * self._fec_headroom
+            if d_unrecovered or loss_rate > tolerance:
+                self.stat_congestion += 1
+                self.slow_start = False
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                logging.debug(
+                    f"AimdController: congestion, loss_rate={loss_rate:.3f}, "
+                    f"tolerance={tolerance:.3f}, repaired={d_repaired}, "
+                    f"unrecovered={d_unrecovered}, rate={self.rate:.0f}B/s"
+                )
+                return
+            # Don't grow the rate while the application doesn't use it
+            if sent_bytes < 0.5 * self.rate * (now - last_time):
+                return
+            if self.slow_start:
+                self.rate = min(self.max_rate, self.rate * 2)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
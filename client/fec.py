@@ -0,0 +1,201 @@
+import functools
+import math
+import threading
+
+from zfec import Decoder, Encoder
+
+
+@functools.lru_cache(maxsize=64)
+def _encoder(k, n):
+    """
+    Cached zfec encoder, building the generator matrix is not free.
+    """
+    return Encoder(k, n)
+
+
+@functools.lru_cache(maxsize=64)
+def _decoder(k, n):
+    """
+    Cached zfec decoder.
+    """
+    return Decoder(k, n)
+
+
+def split_blocks(data: bytes, k):
+    """
+    Pad data with null bytes and split it into k equally sized blocks.
+    """
+    block_size = math.ceil(len(data) / k)
+    pad_len = block_size * k - len(data)
+    if pad_len > 0:
+        data += b"\0" * pad_len  # Pad the last block
+    return [data[i * block_size : (i + 1) * block_size] for i in range(k)]
+
+
+def _interleave(stripes, width):
+    """
+    Concatenate the i-th block of every stripe, for i in range(width).
+
+    Reed-Solomon works on each byte column independently, so a stripe of
+    concatenated blocks encodes / decodes to the concatenated results.
+    """
+    return [b"".join(blocks[i] for blocks in stripes) for i in range(width)]
+
+
+def _deinterleave(joined, sizes):
+    """
+    Slice concatenated blocks back into one list of blocks per stripe.
+    """
+    results = [[] for _ in sizes]
+    for block in joined:
+        offset = 0
+        for pos, size in enumerate(sizes):
+            results[pos].append(block[offset : offset + size])
+            offset += size
+    return results
+
+
+def encode_stripes(k, n, stripes):
+    """
+    Encode several stripes sharing the same (k, n) with a single zfec call.
+
+    Args:
+        k (int): Number of original blocks per stripe.
+        n (int): Number of encoded fragments per stripe.
+        stripes (list): List of stripes, each a list of k equally sized blocks.
+
+    Returns:
+        list: For each stripe, its n encoded fragments.
+    """
+    encoding = StripeEncoding(k, n, stripes)
+    encoding.encode_chunk(0)
+    return encoding.result()
+
+
+class StripeEncoding:
+    """
+    Encoding of several stripes sharing the same (k, n), split into column
+    chunks that can be encoded concurrently (zfec releases the GIL).
+    """
+
+    def __init__(self, k, n, stripes, chunk_size=0):
+        """
+        Initialize StripeEncoding.
+
+        Args:
+            k (int): Number of original blocks per stripe.
+            n (int): Number of encoded fragments per stripe.
+            stripes (list): List of stripes, each a list of k equally sized blocks.
+            chunk_size (int): Max input bytes per chunk, 0 for a single chunk.
+        """
+        self.k = k
+        self.n = n
+        if len(stripes) == 1:
+            self._sizes = None
+            self._blocks = stripes[0]
+        else:
+            self._sizes = [len(blocks[0]) for blocks in stripes]
+            self._blocks = _interleave(stripes, k)
+        width = len(self._blocks[0])
+        step = max(1, chunk_size // k if chunk_size else width)
+        self.chunks = [
+            (start, min(start + step, width)) for start in range(0, width, step)
+        ] or [(0, 0)]
+        self._parts = [None] * len(self.chunks)
+        self._remaining = len(self.chunks)
+        self._error = None
+        self._lock = threading.Lock()
+
+    def encode_chunk(self, i):
+        """
+        Encode the i-th chunk.
+
+        Returns:
+            bool: True if it was the last chunk left to encode.
+        """
+        start, stop = self.chunks[i]
+        blocks = self._blocks
+        if len(self.chunks) > 1:
+            blocks = [block[start:stop] for block in blocks]
+        try:
+            self._parts[i] = _encoder(self.k, self.n).encode(blocks)
+        except Exception as e:
+            self._error = e
+        with self._lock:
+            self._remaining -= 1
+            return not self._remaining
+
+    def done(self):
+        """
+        Check whether every chunk is encoded.
+        """
+        return not self._remaining
+
+    def result(self):
+        """
+        Return the n encoded fragments of every stripe, raises the encoding error if any.
+        """
+        if self._error is not None:
+            raise self._error
+        if len(self._parts) == 1:
+            encoded = self._parts[0]
+        else:
+            encoded = [b"".join(part[i] for part in self._parts) for i in range(self.n)]
+        if self._sizes is None:
+            return [encoded]
+        return _deinterleave(encoded, self._sizes)
+
+
+def decode_stripes(k, n, stripes):
+    """
+    Decode several stripes sharing the same (k, n) with as few zfec calls as possible.
+
+    Stripes are grouped by the set of fragment indices used, since zfec needs
+    the same share numbers for every column of one call. Stripes whose k
+    primary blocks all arrived skip the decoder entirely.
+
+    Args:
+        k (int): Number of original blocks per stripe.
+        n (int): Number of encoded fragments per stripe.
+        stripes (list): List of dicts {idx: fragment}, each with at least k entries.
+
+    Returns:
+        list: For each stripe, the joined (still padded) data, or the exception
+        raised while decoding that stripe.
+    """
+    results = [None] * len(stripes)
+    groups = {}
+    primary = tuple(range(k))
+    for pos, fragments in enumerate(stripes):
+        share_ids = tuple(sorted(fragments)[:k])  # Prefer primary blocks
+        if share_ids == primary:
+            results[pos] = b"".join(fragments[i] for i in primary)
+        else:
+            groups.setdefault(share_ids, []).append(pos)
+
+    for share_ids, positions in groups.items():
+        group = [[stripes[pos][i] for i in share_ids] for pos in positions]
+        decoder = None
+        try:
+            decoder = _decoder(k, n)
+            if len(group) == 1:
+                decoded = [decoder.decode(group[0], list(share_ids))]
+            else:
+                sizes = [len(shares[0]) for shares in group]
+                joined = decoder.decode(_interleave(group, k), list(share_ids))
+                decoded = _deinterleave(joined, sizes)
+        except Exception as e:
+            if len(group) == 1 or decoder is None:
+                for pos in positions:
+                    results[pos] = e
+                continue
+            # Retry one by one so a single bad stripe doesn't fail the group
+            decoded = []
+            for shares in group:
+                try:
+                    decoded.append(decoder.decode(shares, list(share_ids)))
+                except Exception as err:
+                    decoded.append(err)
+        for pos, blocks in zip(positions, decoded):
+            results[pos] = blocks if isinstance(blocks, Exception) else b"".join(blocks)
+    return results
@@ -0,0 +1,182 @@
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+PID_PAT = 0x0000
+PID_NULL = 0x1FFF
+
+# Importance tiers, higher is more important
+TIER_DROP = 0  # Null packets, not sent at all
+TIER_NORMAL = 1  # Non key video frames
+TIER_HIGH = 2  # Audio and other tables
+TIER_CRITICAL = 3  # PAT / PMT and key frames
+
+# Default redundancy ratio for each tier
+DEFAULT_TIER_REDUNDANCY = {
+    TIER_NORMAL: 2,
+    TIER_HIGH: 3,
+    TIER_CRITICAL: 4,
+}
+
+# H.264 NAL unit types that start a decodable picture (IDR slice, SPS, PPS)
+_H264_KEY_NALS = {5, 7, 8}
+# H.265 NAL unit types (IDR_W_RADL .. CRA, VPS, SPS, PPS)
+_H265_KEY_NALS = {19, 20, 21, 32, 33, 34}
+
+
+class TsClassifier:
+    """
+    Tag MPEG-TS datagrams by importance so they can get unequal error protection.
+    """
+
+    def __init__(self, tier_redundancy=None):
+        """
+        Initialize TsClassifier.
+
+        Args:
+            tier_redundancy (dict): Redundancy ratio for each tier, None for DEFAULT_TIER_REDUNDANCY.
+        """
+        self.tier_redundancy = dict(tier_redundancy or DEFAULT_TIER_REDUNDANCY)
+        self._pmt_pids = set()
+        self._pid_tiers = {}  # Tier of the PES currently carried on each PID
+        self._hevc_pids = set()  # Video PIDs carrying H.265, learned from the PMT
+
+        # Statistics
+        self.stat_packets = {tier: 0 for tier in (TIER_DROP, *self.tier_redundancy)}
+        self.stat_datagrams = {tier: 0 for tier in (TIER_DROP, *self.tier_redundancy)}
+
+    def classify(self, datagram: bytes):
+        """
+        Classify a datagram of TS packets and strip its null packets.
+
+        Args:
+            datagram (bytes): Concatenated 188 byte TS packets.
+
+        Returns:
+            (payload, tier): Datagram without null packets and its most important tier.
+        """
+        if len(datagram) % TS_PACKET_SIZE or datagram[:1] != bytes([TS_SYNC_BYTE]):
+            # Not aligned TS, protect it as a whole
+            self.stat_datagrams[TIER_CRITICAL] += 1
+            return datagram, TIER_CRITICAL
+
+        kept = []
+        tier = TIER_DROP
+        for offset in range(0, len(datagram), TS_PACKET_SIZE):
+            packet = datagram[offset : offset + TS_PACKET_SIZE]
+            packet_tier = self._classify_packet(packet)
+            self.stat_packets[packet_tier] += 1
+            if packet_tier == TIER_DROP:
+                continue
+            kept.append(packet)
+            tier = max(tier, packet_tier)
+        self.stat_datagrams[tier] += 1
+        return b"".join(kept), tier
+
+    def redundancy(self, tier):
+        """
+        Redundancy ratio to use for a tier.
+        """
+        return self.tier_redundancy[tier]
+
+    def _classify_packet(self, packet):
+        """
+        Classify a single TS packet.
+        """
+        if packet[0] != TS_SYNC_BYTE:
+            return TIER_CRITICAL
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        if pid == PID_NULL:
+            return TIER_DROP
+
+        pusi = packet[1] & 0x40
+        adaptation = (packet[3] >> 4) & 0x3
+        payload_start = 4
+        random_access = False
+        if adaptation in (2, 3):
+            af_len = packet[4]
+            if af_len > 0:
+                random_access = bool(packet[5] & 0x40)
+            payload_start = 5 + af_len
+        payload = packet[payload_start:] if adaptation in (1, 3) else b""
+
+        if pid == PID_PAT:
+            if pusi and payload:
+                self._parse_pat(payload)
+            return TIER_CRITICAL
+        if pid in self._pmt_pids:
+            if pusi and payload:
+                self._parse_pmt(payload)
+            return TIER_CRITICAL
+        if pid < 0x20:
+            return TIER_HIGH  # Other tables (SDT, EIT, ...)
+
+        if pusi and payload[:3] == b"\x00\x00\x01" and len(payload) > 3:
+            # Start of a new PES, decide the tier of the whole PES
+            stream_id = payload[3]
+            if 0xE0 <= stream_id <= 0xEF:
+                key = random_access or self._has_key_nal(pid, payload)
+                self._pid_tiers[pid] = TIER_CRITICAL if key else TIER_NORMAL
+            else:
+                self._pid_tiers[pid] = TIER_HIGH
+        elif random_access:
+            self._pid_tiers[pid] = TIER_CRITICAL
+        return self._pid_tiers.get(pid, TIER_HIGH)
+
+    def _section(self, payload):
+        """
+        Return the PSI section at the start of a payload, skipping the pointer field.
+        """
+        start = 1 + payload[0]
+        section = payload[start:]
+        if len(section) < 3:
+            return b""
+        section_len = ((section[1] & 0x0F) << 8) | section[2]
+        return section[: 3 + section_len]
+
+    def _parse_pat(self, payload):
+        """
+        Learn the PMT PIDs from a PAT.
+        """
+        section = self._section(payload)
+        # 8 byte header, 4 byte entries, 4 byte CRC
+        for offset in range(8, len(section) - 4, 4):
+            program = (section[offset] << 8) | section[offset + 1]
+            pid = ((section[offset + 2] & 0x1F) << 8) | section[offset + 3]
+            if program != 0:
+                self._pmt_pids.add(pid)
+
+    def _parse_pmt(self, payload):
+        """
+        Learn which video PIDs carry H.265 from a PMT.
+        """
+        section = self._section(payload)
+        if len(section) < 12:
+            return
+        program_info_len = ((section[10] & 0x0F) << 8) | section[11]
+        offset = 12 + program_info_len
+        while offset + 5 <= len(section) - 4:
+            stream_type = section[offset]
+            pid = ((section[offset + 1] & 0x1F) << 8) | section[offset + 2]
+            es_info_len = ((section[offset + 3] & 0x0F) << 8) | section[offset + 4]
+            if stream_type == 0x24:
+                self._hevc_pids.add(pid)
+            offset += 5 + es_info_len
+
+    def _has_key_nal(self, pid, payload):
+        """
+        Look for a key frame NAL unit in the first packet of a video PES.
+        """
+        if len(payload) < 9:
+            return False
+        es = payload[9 + payload[8] :]  # Skip the PES header
+        hevc = pid in self._hevc_pids
+        start = es.find(b"\x00\x00\x01")
+        while start != -1 and start + 3 < len(es):
+            header = es[start + 3]
+            if hevc:
+                if ((header >> 1) & 0x3F) in _H265_KEY_NALS:
+                    return True
+            elif (header & 0x1F) in _H264_KEY_NALS:
+                return True
+            start = es.find(b"\x00\x00\x01", start + 3)
+        return False
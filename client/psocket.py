@@ -1,14 +1,238 @@
 import math
+import select
 import socket
 import struct
+import sys
 import time
 import threading
 import queue
 import logging
-from collections import deque
+from collections import OrderedDict, deque, namedtuple
 import random
 
-from zfec import Decoder, Encoder
+from compression import decompress
+from fec import StripeEncoding, decode_stripes, encode_stripes, split_blocks
+from tracing import (
+    STAGE_DECODE_END,
+    STAGE_DECODE_START,
+    STAGE_DELIVER,
+    STAGE_ENCODE_END,
+    STAGE_ENCODE_START,
+    STAGE_ENQUEUE,
+    STAGE_FIRST_IN,
+    STAGE_FIRST_OUT,
+    STAGE_LAST_OUT,
+    ClockOffsetEstimator,
+    LatencyHistogram,
+)
+from reactor import Reactor
+
+# Packet types, low 4 bits of the first byte of every packet
+PKT_DATA = 0
+PKT_NACK = 1
+PKT_CLOCK_REQ = 2
+PKT_CLOCK_RESP = 3
+PKT_REPORT = 4
+TYPE_MASK = 0x0F
+
+# Flags, high 4 bits of the first byte
+FLAG_TIMESTAMP = 0x80  # DATA_HEADER is followed by TIMESTAMP_EXT
+FLAG_COMPRESSED = 0x40  # The batch data is a compression.Compressor payload
+
+# type, stream_id, client_id, batch_id, idx, k, n, orig_len
+DATA_HEADER = struct.Struct(">BBIIBBBH")
+# type, client_id, batch_id, count, followed by count missing fragment indices
+NACK_HEADER = struct.Struct(">BIIB")
+# sender monotonic clock (ns) when the data was enqueued
+TIMESTAMP_EXT = struct.Struct(">Q")
+# type, responder client_id, request time (ns), response time (ns)
+CLOCK_HEADER = struct.Struct(">BIQQ")
+# type, reported client_id, cumulative fragments received, fragments lost,
+# batches repaired by FEC, batches unrecovered
+REPORT_HEADER = struct.Struct(">BIIIII")
+
+
+# Max packets read per reactor wake up, so busy sockets take turns
+RECV_DRAIN_MAX = 256
+# recvfrom flag for a non-blocking read of a blocking socket, 0 where unsupported
+_MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+# Linux socket options missing from the socket module: SO_RXQ_OVFL attaches the
+# count of datagrams the kernel dropped on a full receive buffer to each packet,
+# SO_RCVBUFFORCE sets SO_RCVBUF past net.core.rmem_max (needs CAP_NET_ADMIN)
+_LINUX = sys.platform.startswith("linux")
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40 if _LINUX else None)
+SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33 if _LINUX else None)
+# Approximate kernel memory per datagram besides its payload, for SO_RCVBUF sizing
+RCVBUF_PACKET_OVERHEAD = 768
+_RXQ_OVFL_COUNTER = struct.Struct("=I")
+_RXQ_OVFL_SPACE = socket.CMSG_SPACE(_RXQ_OVFL_COUNTER.size)
+# Seconds the overload mode lasts after the last kernel or receive queue drop
+OVERLOAD_HOLD = 1.0
+# Max senders tracked at once, the least recently heard from is forgotten first
+MAX_PEERS = 1024
+
+# Stream ordering modes
+ORDER_UNORDERED = "unordered"  # Deliver batches as soon as they decode
+ORDER_SEQUENCED = "sequenced"  # Drop batches older than the last delivered one
+
+# A send waiting in a stream queue, see PerfectSocket._enqueue
+_SendItem = namedtuple(
+    "_SendItem", "stream batch_id payload address k n enqueue_time sent_at flags"
+)
+
+
+class _OutboxEntry:
+    """
+    A batch in the send outbox, from its encoding to its last fragment sent.
+    """
+
+    __slots__ = ("item", "fragments", "packets", "failed", "encoding", "stripe")
+
+    def __init__(self, item):
+        self.item = item
+        self.fragments = None  # None while encoding
+        self.packets = []  # Packets sent so far
+        self.failed = False
+        self.encoding = None  # StripeEncoding while encoded on the pool
+        self.stripe = 0  # Index of the batch in the encoding
+
+
+class PerfectStream:
+    """
+    A logical stream multiplexed over a PerfectSocket, with its own queue, FEC parameters, ordering mode and stats.
+    """
+
+    def __init__(
+        self,
+        psocket,
+        stream_id,
+        priority=0,
+        redundancy_ratio=2,
+        ordering=ORDER_UNORDERED,
+        max_queue_size=200,
+        mtu=1400,
+        min_k=4,
+        compression=None,
+        max_recv_queue_size=1000,
+    ):
+        """
+        Initialize PerfectStream, use PerfectSocket.open_stream instead of calling this directly.
+
+        Args:
+            psocket (PerfectSocket): Socket the stream is multiplexed over.
+            stream_id (int): Stream id (0-255), carried in every packet header.
+            priority (int): Higher priority streams are sent first.
+            redundancy_ratio (int): Default redundancy ratio, n = k * redundancy_ratio.
+            ordering (str): ORDER_UNORDERED or ORDER_SEQUENCED.
+            max_queue_size (int): Max size of the stream send queue.
+            mtu (int): Default maximum packet size.
+            min_k (int): Default minimum number of fragments.
+            compression (Compressor): Compression stage run before FEC encoding, None to send data as it is.
+            max_recv_queue_size (int): Max decoded messages waiting for recvfrom, the oldest are dropped beyond it.
+        """
+        if ordering not in (ORDER_UNORDERED, ORDER_SEQUENCED):
+            raise ValueError(f"PerfectStream: unknown ordering mode {ordering!r}.")
+        self.psocket = psocket
+        self.stream_id = stream_id
+        self.priority = priority
+        self.redundancy_ratio = redundancy_ratio
+        self.ordering = ordering
+        self.mtu = mtu
+        self.min_k = min_k
+        self.compression = compression
+        self._send_queue = queue.Queue(maxsize=max_queue_size)
+        self._ready = deque()  # Decoded (data, addr) not yet returned to the caller
+        self._max_recv_queue_size = max_recv_queue_size
+        self._last_batch = (
+            {}
+        )  # client_id -> last delivered batch_id, for sequenced mode
+
+        # Statistics
+        self._stat_send_batch = 0
+        self._stat_send_drop = 0
+        self._stat_queue_full = 0
+        self._stat_recv_batch = 0
+        self._stat_stale_drop = 0
+        self._stat_recv_drop = 0
+
+    def sendto(self, data: bytes, address, redundancy_ratio=None, mtu=None, min_k=None):
+        """
+        Send data on this stream, parameters default to the stream settings.
+        """
+        self.psocket._enqueue(
+            self,
+            data,
+            address,
+            redundancy_ratio or self.redundancy_ratio,
+            mtu or self.mtu,
+            min_k or self.min_k,
+        )
+
+    def recvfrom(self, timeout=None):
+        """
+        Receive data on this stream (blocking until a complete batch is received).
+        """
+        return self.psocket._recv(self, 1, timeout)[0]
+
+    def recvfrom_many(self, max_count=64, timeout=None):
+        """
+        Receive several messages on this stream at once.
+        """
+        return self.psocket._recv(self, max_count, timeout)
+
+    def stats(self):
+        """
+        Return the stream statistics as a dict.
+        """
+        stats = {
+            "sent": self._stat_send_batch,
+            "dropped": self._stat_send_drop,
+            "queue_full": self._stat_queue_full,
+            "recv": self._stat_recv_batch,
+            "stale": self._stat_stale_drop,
+            "recv_dropped": self._stat_recv_drop,
+            "queued": self._send_queue.qsize(),
+        }
+        if self.compression:
+            stats["compression"] = self.compression.stats()
+        return stats
+
+    def _decompress(self, payload):
+        """
+        Decompress received data, with the stream dictionary if it has one.
+        """
+        if self.compression:
+            return self.compression.decompress(payload)
+        return decompress(payload)
+
+    def _accept(self, client_id, batch_id):
+        """
+        Apply the ordering mode, returns False if the batch must be dropped.
+        """
+        if self.ordering == ORDER_SEQUENCED:
+            last = self._last_batch.get(client_id)
+            # Serial number comparison, batch ids wrap around at 32 bits
+            if last is not None and not 0 < (batch_id - last) & 0xFFFFFFFF < 0x80000000:
+                self._stat_stale_drop += 1
+                return False
+            self._last_batch[client_id] = batch_id
+        self._stat_recv_batch += 1
+        return True
+
+    def _deliver(self, item):
+        """
+        Queue decoded data for recvfrom, called with the socket receive lock held.
+
+        Returns:
+            bool: False if the queue was full and its oldest message was dropped.
+        """
+        self._ready.append(item)
+        if len(self._ready) <= self._max_recv_queue_size:
+            return True
+        self._ready.popleft()
+        self._stat_recv_drop += 1
+        return False
 
 
 class PerfectSocket:
@@ -20,6 +244,7 @@ class PerfectSocket:
         self,
         bind_addr=None,
         max_queue_size=200,
+        max_recv_queue_size=1000,
         max_send_rate=None,
         on_send_error=None,
         on_queue_full=None,
@@ -28,6 +253,24 @@ class PerfectSocket:
         drop_if_full=False,
         processed_maxlen=10000,
         batch_timeout=10,
+        encode_batch_size=32,
+        nack_deadline=None,
+        nack_retries=3,
+        retransmit_cache_size=0,
+        trace_latency=False,
+        clock_sync_interval=1.0,
+        profiler=None,
+        congestion_control=None,
+        report_interval=None,
+        reactor=None,
+        max_rcvbuf=16 * 1024 * 1024,
+        max_partial_batches=None,
+        encode_chunk_size=64 * 1024,
+        max_outbox_bytes=4 * 1024 * 1024,
+        compression=None,
+        transport=None,
+        clock=None,
+        client_id=None,
     ):
         """
         Initialize PerfectSocket.
@@ -35,6 +278,7 @@ class PerfectSocket:
         Args:
             bind_addr (tuple): (host, port) to bind, or None for no binding.
             max_queue_size (int): Max size of the send queue to avoid memory overflow.
+            max_recv_queue_size (int): Max decoded messages per stream waiting for recvfrom, the oldest are dropped beyond it.
             max_send_rate (float): Max send rate (batch/sec), None for unlimited.
             on_send_error (callable): Callback on send failure, args (exception, data, address).
             on_queue_full (callable): Callback when queue is full, args (data, address).
@@ -43,8 +287,29 @@ class PerfectSocket:
             drop_if_full (bool): If True, drop new data when queue is full; otherwise block.
             processed_maxlen (int): Max number of processed_batches to keep.
             batch_timeout (float): Timeout seconds for each batch.
+            encode_batch_size (int): Max number of queued sends encoded together in one call.
+            nack_deadline (float): Seconds a partial batch may stall before its missing fragments are NACKed, None to disable.
+            nack_retries (int): Max number of NACKs sent per batch.
+            retransmit_cache_size (int): Number of sent batches kept to answer NACKs, 0 to disable.
+            trace_latency (bool): Timestamp sent batches and build a one-way latency histogram of received ones.
+            clock_sync_interval (float): Seconds between clock offset probes to each timestamping peer.
+            profiler (callable): Profiling hook, args (stage, key, clock.monotonic()), None to disable.
+            congestion_control (AimdController): Controller pacing the sender from receiver reports, None for no congestion control.
+            report_interval (float): Seconds between feedback reports sent to each sender, None to disable.
+            reactor (Reactor): Reactor handling the socket I/O, None for the process-wide one.
+            max_rcvbuf (int): Max SO_RCVBUF (bytes) the receive buffer grows to when bursts fill it, 0 to disable.
+            max_partial_batches (int): Max number of partial batches kept, the ones furthest from k are shed first, None for unlimited.
+            encode_chunk_size (int): Input bytes per encode job, larger sends are encoded in parallel on the reactor encode pool, 0 to encode inline.
+            max_outbox_bytes (int): Max bytes of fragments encoded (or encoding) ahead of transmission.
+            compression (Compressor): Compression stage of stream 0, None to send data as it is.
+            transport (object): Datagram socket-like object used instead of a new UDP socket, e.g. simulator.SimSocket.
+            clock (object): Time source with the time module interface (time, monotonic, monotonic_ns, sleep) and wait(condition, timeout) for blocking calls, None for the time module.
+            client_id (int): 32-bit sender id carried in every packet, None for a random one.
         """
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock = transport or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Without MSG_DONTWAIT, poll UDP sockets before reading so reads don't block
+        self._poll_reads = not _MSG_DONTWAIT and transport is None
+        self._clock = clock or time
         if bind_addr:
             self.sock.bind(bind_addr)
         self.batches = {}
@@ -54,12 +319,31 @@ class PerfectSocket:
         )  # Auto-recycle with deque
         self._processed_set = set()  # For fast lookup with deque
 
-        # Send queue and thread
-        self._send_queue = queue.Queue(maxsize=max_queue_size)
+        # Logical streams, stream 0 is used by sendto / recvfrom
+        self._streams = {}
+        self._streams_lock = threading.Lock()
+        self._max_queue_size = max_queue_size
+        self._max_recv_queue_size = max_recv_queue_size
+        self.open_stream(0, redundancy_ratio=4, compression=compression)
+
+        # Send queues, sent by the reactor workers
         self._max_send_rate = max_send_rate
-        self._stop_event = threading.Event()
-        self._send_thread = threading.Thread(target=self._send_worker, daemon=True)
-        self._send_thread.start()
+        self._encode_batch_size = max(1, encode_batch_size)
+        self._outbox = deque()  # Batches being encoded or sent, see _send_step
+        self._outbox_bytes = 0
+        self._encode_chunk_size = encode_chunk_size
+        self._max_outbox_bytes = max_outbox_bytes
+        self._encoding = 0  # Groups being encoded on the reactor encode pool
+        self._pipelined = False  # The last group taken went to the encode pool
+        self._next_send_time = 0  # Rate limiting
+        self._unsent = 0  # Queued or partly sent batches, waited for by close
+        self._unsent_cond = threading.Condition()
+
+        # Registered with the reactor on first sendto / recvfrom
+        self._reactor = reactor or Reactor.default()
+        self._registered = False
+        self._register_lock = threading.Lock()
+        self._detached = False  # Unregistered, the reactor must leave it alone
 
         self._closed = False  # Closed state flag
 
@@ -78,12 +362,78 @@ class PerfectSocket:
         self._stat_recv_batch = 0
         self._stat_decode_fail = 0
         self._stat_send_total_delay = 0.0
+        self._stat_nack_sent = 0
+        self._stat_nack_recv = 0
+        self._stat_nack_recovered = 0
+        self._stat_retransmit = 0
+        self._stat_retransmit_miss = 0
+        self._stat_kernel_drop = 0
+        self._stat_shed = 0
+        self._stat_unknown_stream = 0
+        self._stat_malformed = 0
 
         self._batch_timeout = batch_timeout
 
+        # Selective retransmission
+        self._nack_deadline = nack_deadline
+        self._nack_retries = nack_retries
+        self._retransmit_cache_size = retransmit_cache_size
+        self._retransmit_cache = OrderedDict()  # batch_id -> (address, data, packets)
+        self._retransmit_lock = threading.Lock()
+
+        # Latency tracing
+        self._trace_latency = trace_latency
+        self._clock_sync_interval = clock_sync_interval
+        self._clock_peers = (
+            {}
+        )  # client_id -> [addr, ClockOffsetEstimator, last probe time]
+        self.latency_histogram = LatencyHistogram() if trace_latency else None
+        self._profiler = profiler
+
+        # Congestion control
+        self._cc = congestion_control
+        self._queued_bytes = 0
+        self._queued_cond = (
+            threading.Condition()
+        )  # Notified when the reactor takes queued sends
+        self._report_interval = report_interval
+        self._report_peers = {}  # client_id -> receive counters reported to the sender
+        self._stat_peer_lost = 0  # Fragments lost by senders forgotten since
+        self._last_report_time = 0
+        self._last_expire_time = 0
+        # Periodic work for the reactor besides batch expiry
+        self._feedback = bool(
+            nack_deadline
+            or retransmit_cache_size
+            or trace_latency
+            or congestion_control
+            or report_interval
+        )
+
+        # Receive overload detection and load shedding
+        self._max_rcvbuf = max_rcvbuf
+        self._max_partial_batches = max_partial_batches
+        self._rcvbuf = None  # Current SO_RCVBUF, read on first use
+        self._rcvbuf_capped = False
+        self._kernel_drops = 0  # Last SO_RXQ_OVFL counter
+        self._overload_until = 0
+        self._rxq_ovfl = False
+        if SO_RXQ_OVFL is not None:
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self._rxq_ovfl = True
+            except OSError:
+                pass
+
+        # Notified when a stream gets decoded data or the socket closes
+        self._recv_cond = threading.Condition()
+        # Guards batches shared between the reactor receive and tick callbacks
+        self._state_lock = threading.Lock()
+
         self._batch_id_counter = 0
         self._batch_id_lock = threading.Lock()
-        self._client_id = random.getrandbits(32)  # 32-bit unique identifier
+        # 32-bit unique identifier
+        self._client_id = random.getrandbits(32) if client_id is None else client_id
 
     def __enter__(self):
         """
@@ -103,22 +453,149 @@ class PerfectSocket:
         """
         self.close(wait_queue=False)
 
-    def sendto(self, data: bytes, address, redundancy_ratio=4, mtu=1400, min_k=4):
+    def sendto(self, data: bytes, address, redundancy_ratio=None, mtu=None, min_k=None):
+        """
+        Send data on stream 0 (asynchronously, actual sending is handled by the reactor).
+
+        Args:
+            data (bytes): Data to send.
+            address (tuple): Target (host, port).
+            redundancy_ratio (int): Redundancy ratio, n = k * redundancy_ratio, None for the stream 0 default (4).
+            mtu (int): Maximum packet size, None for the stream 0 default (1400).
+            min_k (int): Minimum number of fragments, None for the stream 0 default (4).
+        """
+        self._streams[0].sendto(data, address, redundancy_ratio, mtu, min_k)
+
+    def open_stream(
+        self,
+        stream_id,
+        priority=0,
+        redundancy_ratio=2,
+        ordering=ORDER_UNORDERED,
+        max_queue_size=None,
+        mtu=1400,
+        min_k=4,
+        compression=None,
+        max_recv_queue_size=None,
+    ):
+        """
+        Open a logical stream sharing this socket and its reactor callbacks.
+
+        Args:
+            stream_id (int): Stream id (0-255).
+            priority (int): Higher priority streams are sent first.
+            redundancy_ratio (int): Default redundancy ratio of the stream.
+            ordering (str): ORDER_UNORDERED or ORDER_SEQUENCED.
+            max_queue_size (int): Max size of the stream send queue, None for the socket default.
+            mtu (int): Default maximum packet size of the stream.
+            min_k (int): Default minimum number of fragments of the stream.
+            compression (Compressor): Compression stage of the stream, None to send data as it is.
+            max_recv_queue_size (int): Max decoded messages waiting for recvfrom, None for the socket default.
+
+        Returns:
+            PerfectStream: The opened stream.
+        """
+        if not 0 <= stream_id <= 0xFF:
+            raise ValueError(f"PerfectSocket: stream id {stream_id} out of range.")
+        with self._streams_lock:
+            if stream_id in self._streams:
+                raise ValueError(f"PerfectSocket: stream {stream_id} already open.")
+            stream = PerfectStream(
+                self,
+                stream_id,
+                priority=priority,
+                redundancy_ratio=redundancy_ratio,
+                ordering=ordering,
+                max_queue_size=max_queue_size or self._max_queue_size,
+                mtu=mtu,
+                min_k=min_k,
+                compression=compression,
+                max_recv_queue_size=max_recv_queue_size or self._max_recv_queue_size,
+            )
+            # Keep streams sorted by priority for the send scheduler, copy on
+            # write so the reactor can iterate without locking
+            streams = sorted(
+                [*self._streams.values(), stream],
+                key=lambda s: (-s.priority, s.stream_id),
+            )
+            self._streams = {s.stream_id: s for s in streams}
+        return stream
+
+    def stream(self, stream_id):
+        """
+        Return an open stream by id, opening it with default settings if needed.
+
+        Received batches are only reassembled for open streams, open the
+        streams the application reads before data arrives on them.
+        """
+        try:
+            return self._streams[stream_id]
+        except KeyError:
+            try:
+                return self.open_stream(stream_id)
+            except ValueError:
+                return self._streams[stream_id]  # Opened concurrently
+
+    def _enqueue(self, stream, data, address, redundancy_ratio, mtu, min_k):
         """
-        Send data (asynchronously, actual sending is handled by background thread).
+        Compress data if the stream compresses, compute (k, n) and put it into the stream send queue.
+
+        Raises:
+            ValueError: The data doesn't fit a batch, k and n are at most 255 and the payload at most 65535 bytes.
         """
         if self._closed:
             raise RuntimeError("PerfectSocket is closed, cannot sendto.")
-        k = max(min_k, math.ceil(len(data) / mtu))
+        payload, flags = data, 0
+        if stream.compression:
+            compressed = stream.compression.compress(data)
+            if compressed is not None:
+                payload, flags = compressed, FLAG_COMPRESSED
+        k = max(min_k, math.ceil(len(payload) / mtu))
         n = k * redundancy_ratio
+        # Limits of the packet header fields
+        if n > 0xFF or k > 0xFF or len(payload) > 0xFFFF:
+            raise ValueError(
+                f"PerfectSocket: {len(payload)} bytes with k={k}, n={n} don't fit a batch "
+                f"(k, n <= 255, at most 65535 bytes), send smaller data or lower the redundancy."
+            )
+        batch_id = self._next_batch_id()
+        sent_at = self._clock.monotonic_ns() if self._trace_latency else None
+        if self._profiler:
+            self._profiler(
+                STAGE_ENQUEUE, (self._client_id, batch_id), self._clock.monotonic()
+            )
+        item = _SendItem(
+            stream,
+            batch_id,
+            payload,
+            address,
+            k,
+            n,
+            self._clock.time(),
+            sent_at,
+            flags,
+        )
+        self._activate()
+        with self._unsent_cond:
+            self._unsent += 1
+        admitted = queued = False
         try:
+            if self._cc:
+                self._admit(len(payload))
+                admitted = True
             if self._drop_if_full:
-                self._send_queue.put_nowait((data, address, k, n, time.time()))
+                stream._send_queue.put_nowait(item)
+            elif self._clock is time:
+                stream._send_queue.put(item)
             else:
-                self._send_queue.put((data, address, k, n, time.time()))
+                self._put_waiting(stream, item)
+            queued = True
+            self._reactor.schedule_send(self)
         except queue.Full:
             self._stat_queue_full += 1
             self._stat_send_drop += 1
+            stream._stat_queue_full += 1
+            stream._stat_send_drop += 1
             if self._on_queue_full:
                 self._on_queue_full(data, address)
             else:
@@ -126,13 +603,84 @@ class PerfectSocket:
             logging.debug(
                 f"PerfectSocket: queue full, total dropped: {self._stat_send_drop}"
             )
+        finally:
+            # Dropped, or a blocking call raised in a simulation callback
+            if not queued:
+                if admitted:
+                    with self._queued_cond:
+                        self._queued_bytes -= len(payload)
+                self._sent(1)
 
-    def _pack_header(self, batch_id, idx, k, n, orig_len):
+    def _activate(self):
         """
-        Pack packet header.
+        Register with the reactor on first use, which starts its threads if needed.
+        """
+        if self._registered:
+            return
+        with self._register_lock:
+            if not self._registered and not self._closed:
+                self._reactor.register(self)
+                self._registered = True
+
+    def _sent(self, count):
         """
-        return struct.pack(
-            ">IIBBBH",
+        Count batches as done sending (or dropped), for close to wait on.
+        """
+        with self._unsent_cond:
+            self._unsent -= count
+            if self._unsent <= 0:
+                self._unsent_cond.notify_all()
+
+    def _admit(self, size):
+        """
+        Queue admission under congestion control, block or raise queue.Full
+        while more than max_queue_delay of data at the current rate is queued.
+        """
+        with self._queued_cond:
+            while True:
+                if not self._queued_bytes or self._cc.admit(self._queued_bytes + size):
+                    self._queued_bytes += size
+                    return
+                if self._drop_if_full or self._closed:
+                    raise queue.Full
+                # Polled as well, the controller admits more as its rate grows
+                self._wait(self._queued_cond, 0.005)
+
+    def _put_waiting(self, stream, item):
+        """
+        Put a send into a full stream queue once the reactor takes some, waiting on the socket clock.
+        """
+        with self._queued_cond:
+            while True:
+                try:
+                    stream._send_queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    if self._closed:
+                        raise
+                    self._wait(self._queued_cond, None)
+
+    def _wait(self, condition, timeout):
+        """
+        Wait on a condition held by the caller for up to timeout seconds of the socket clock.
+
+        A virtual clock runs its simulation until then instead, and raises
+        RuntimeError when called from a simulation callback.
+        """
+        if self._clock is time:
+            condition.wait(timeout)
+        else:
+            self._clock.wait(condition, timeout)
+
+    def _pack_header(
+        self, stream_id, batch_id, idx, k, n, orig_len, sent_at=None, flags=0
+    ):
+        """
+        Pack packet header, with the timestamp extension if sent_at is given.
+        """
+        header = DATA_HEADER.pack(
+            (PKT_DATA if sent_at is None else PKT_DATA | FLAG_TIMESTAMP) | flags,
+            stream_id,
             self._client_id,
             batch_id,
             idx,
@@ -140,6 +688,9 @@ class PerfectSocket:
             n,
             orig_len,
         )
+        if sent_at is None:
+            return header
+        return header + TIMESTAMP_EXT.pack(sent_at)
 
     def _send_fragment(self, packet, address, data, retry_limit):
         """
@@ -159,77 +710,238 @@ class PerfectSocket:
                     else:
                         logging.error(f"PerfectSocket: sendto failed: {e}")
                     return False
-                time.sleep(0.01)  # Wait before retry
+                self._clock.sleep(0.01)  # Wait before retry
 
-    def _send_worker(self):
+    def _submit_items(self, items):
         """
-        Background thread: fetch data from queue and actually send.
+        Encode queued sends into the outbox, grouping same-(k, n) items into a single encoder call.
+
+        Groups above twice encode_chunk_size are split into column chunks
+        encoded on the reactor encode pool, their entries wait in the outbox
+        (in order) while the batches before them are transmitted.
         """
-        last_send_time = 0
-        while not self._stop_event.is_set() or not self._send_queue.empty():
+        groups = {}
+        for pos, item in enumerate(items):
+            groups.setdefault((item.k, item.n), []).append(pos)
+        entries = [_OutboxEntry(item) for item in items]
+        self._pipelined = False
+        for (k, n), positions in groups.items():
+            if self._profiler:
+                self._profile_items(STAGE_ENCODE_START, items, positions)
+            stripes = [split_blocks(items[pos].payload, k) for pos in positions]
+            size = sum(len(items[pos].payload) for pos in positions)
+            if self._encode_chunk_size and size > 2 * self._encode_chunk_size:
+                encoding = StripeEncoding(k, n, stripes, self._encode_chunk_size)
+                for stripe, pos in enumerate(positions):
+                    entries[pos].encoding = encoding
+                    entries[pos].stripe = stripe
+                self._encoding += 1
+                self._pipelined = True
+                for i in range(len(encoding.chunks)):
+                    self._reactor.submit_encode(
+                        self._encode_chunk, encoding, i, items, positions
+                    )
+                continue
             try:
-                data, address, k, n, enqueue_time = self._send_queue.get(timeout=0.1)
-            except queue.Empty:
+                encoded = encode_stripes(k, n, stripes)
+            except Exception as e:
+                for pos in positions:
+                    self._fail_entry(entries[pos], e)
+                continue
+            for pos, fragments in zip(positions, encoded):
+                entries[pos].fragments = fragments
+            if self._profiler:
+                self._profile_items(STAGE_ENCODE_END, items, positions)
+        for entry in entries:
+            self._outbox_bytes += self._entry_bytes(entry)
+        self._outbox.extend(entries)
+
+    def _encode_chunk(self, encoding, i, items, positions):
+        """
+        Encode pool job: encode one chunk, and schedule a send step after the last one.
+        """
+        if not encoding.encode_chunk(i):
+            return
+        if self._profiler:
+            self._profile_items(STAGE_ENCODE_END, items, positions)
+        self._reactor.schedule_send(self)
+
+    def _resolve_encoding(self, encoding):
+        """
+        Hand the fragments of a group encoded on the pool to its outbox entries.
+        """
+        self._encoding -= 1
+        try:
+            results = encoding.result()
+        except Exception as e:
+            results = None
+            error = e
+        for entry in self._outbox:
+            if entry.encoding is not encoding:
                 continue
-            batch_id = self._next_batch_id()
-
-            block_size = math.ceil(len(data) / k)
-            pad_len = block_size * k - len(data)
-            if pad_len > 0:
-                data += b"\0" * pad_len  # Pad the last block
-
-            # Split data into blocks
-            blocks = [data[i * block_size : (i + 1) * block_size] for i in range(k)]
-            encoder = Encoder(k, n)
-            fragments = encoder.encode(blocks)
-
-            send_failed = False
-            for idx, fragment in enumerate(fragments):
-                header = self._pack_header(batch_id, idx, k, n, len(data) - pad_len)
-                packet = header + fragment
-                if not self._send_fragment(packet, address, data, self._send_retry):
-                    send_failed = True
+            entry.encoding = None
+            if results is not None:
+                entry.fragments = results[entry.stripe]
+            else:
+                self._fail_entry(entry, error)
+
+    def _fail_entry(self, entry, error):
+        """
+        Drop an outbox entry whose encoding failed, like a failed send.
+        """
+        entry.fragments, entry.failed = [], True
+        self._stat_send_fail += 1
+        if self._on_send_error:
+            self._on_send_error(error, entry.item.payload, entry.item.address)
+        else:
+            logging.error(f"PerfectSocket: encode failed: {error}")
+
+    @staticmethod
+    def _entry_bytes(entry):
+        """
+        Approximate size of the fragments of an outbox entry.
+        """
+        item = entry.item
+        return len(item.payload) * item.n // item.k
+
+    def _profile_items(self, stage, items, positions):
+        """
+        Call the profiling hook for a group of queued sends.
+        """
+        now = self._clock.monotonic()
+        for pos in positions:
+            self._profiler(stage, (self._client_id, items[pos].batch_id), now)
+
+    def _take_items(self):
+        """
+        Take up to encode_batch_size queued sends, highest priority streams first.
+        """
+        items = []
+        for stream in self._streams.values():
+            while len(items) < self._encode_batch_size:
+                try:
+                    items.append(stream._send_queue.get_nowait())
+                except queue.Empty:
+                    break
+        if items:
+            with self._queued_cond:
+                if self._cc:
+                    self._queued_bytes -= sum(len(item.payload) for item in items)
+                self._queued_cond.notify_all()
+        return items
+
+    def _send_step(self):
+        """
+        Reactor callback: encode queued sends and send their fragments.
+
+        When the congestion controller or max_send_rate asks to wait, the rest
+        of the batches stay in the outbox for a later step instead of blocking
+        a reactor worker. Large sends are encoded on the reactor encode pool
+        while the batches before them are transmitted, one group ahead, and
+        the outbox is sent in order.
+
+        Returns:
+            float: Seconds to wait before the next step (0 for right away), None when idle.
+        """
+        if self._detached:
+            return None
+        ready = self._outbox and self._outbox[0].fragments is not None
+        # Take more when there is nothing to transmit, or to encode the next
+        # group on the pool while this one is transmitted
+        if self._outbox_bytes < self._max_outbox_bytes and (
+            not ready or (self._pipelined and not self._encoding)
+        ):
+            items = self._take_items()
+            if items:
+                self._submit_items(items)
+        if not self._outbox:
+            return None
+
+        while self._outbox:
+            entry = self._outbox[0]
+            if entry.fragments is None:
+                if not entry.encoding.done():
+                    return None  # _encode_chunk schedules the next step
+                self._resolve_encoding(entry.encoding)
+            item, fragments, packets = entry.item, entry.fragments, entry.packets
+            stream, batch_id = item.stream, item.batch_id
+            # Rate limiting
+            if not packets and self._max_send_rate:
+                wait = self._next_send_time - self._clock.monotonic()
+                if wait > 0:
+                    return wait
+            for idx in range(len(packets), len(fragments)):
+                if self._detached:
+                    return None  # Closed without waiting, drop the rest
+                header = self._pack_header(
+                    stream.stream_id,
+                    batch_id,
+                    idx,
+                    item.k,
+                    item.n,
+                    len(item.payload),
+                    item.sent_at,
+                    item.flags,
+                )
+                packet = header + fragments[idx]
+                if self._cc:
+                    wait = self._cc.pace(len(packet))
+                    if wait > 0:
+                        return wait
+                packets.append(packet)
+                if not self._send_fragment(
+                    packet, item.address, item.payload, self._send_retry
+                ):
+                    entry.failed = True
                     break
+                if idx == 0 and self._profiler:
+                    self._profiler(
+                        STAGE_FIRST_OUT,
+                        (self._client_id, batch_id),
+                        self._clock.monotonic(),
+                    )
+            self._outbox.popleft()
+            self._outbox_bytes -= self._entry_bytes(entry)
+            self._sent(1)
+            if self._max_send_rate:
+                self._next_send_time = (
+                    self._clock.monotonic() + 1.0 / self._max_send_rate
+                )
+            send_failed = entry.failed
+
+            if self._profiler and not send_failed:
+                self._profiler(
+                    STAGE_LAST_OUT, (self._client_id, batch_id), self._clock.monotonic()
+                )
+            if self._retransmit_cache_size:
+                self._cache_packets(batch_id, item.address, item.payload, packets)
 
             if not send_failed:
                 self._stat_send_batch += 1
-                delay = time.time() - enqueue_time
+                stream._stat_send_batch += 1
+                if self._cc:
+                    self._cc.on_batch_sent(item.k, item.n)
+                delay = self._clock.time() - item.enqueue_time
                 self._stat_send_total_delay += delay
                 logging.debug(
-                    f"PerfectSocket: sent batch_id={batch_id}, k={k}, n={n}, "
+                    f"PerfectSocket: sent batch_id={batch_id}, k={item.k}, n={item.n}, "
                     f"delay={delay:.4f}s, total_sent={self._stat_send_batch}"
                 )
             else:
                 self._stat_send_drop += 1
+                stream._stat_send_drop += 1
                 logging.debug(
                     f"PerfectSocket: send batch_id={batch_id} failed, total_failed={self._stat_send_fail}, total_dropped={self._stat_send_drop}"
                 )
-            # Rate limiting
-            if self._max_send_rate:
-                interval = 1.0 / self._max_send_rate
-                now = time.time()
-                sleep_time = interval - (now - last_send_time)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                last_send_time = time.time()
+        # Back to the reactor queue, so other sockets get a turn
+        return 0
 
-    def recvfrom(self, timeout=None):
+    def _expire_batches(self):
         """
-        Receive data (blocking until a complete batch is received).
-
-        Args:
-            timeout (float): Socket timeout in seconds, None for unlimited.
-
-        Returns:
-            (data_bytes, addr): Decoded data and source address.
+        Drop partial batches older than batch_timeout.
         """
-        if self._closed:
-            raise RuntimeError("PerfectSocket is closed, cannot recvfrom.")
-        if timeout is not None:
-            self.sock.settimeout(timeout)
-        while True:
-            # --- Clean up expired batches ---
-            now = time.time()
+        now = self._clock.time()
+        with self._state_lock:
             expired = [
                 key
                 for key, t in self._batch_timestamps.items()
@@ -237,75 +949,721 @@ class PerfectSocket:
             ]
             for key in expired:
                 if key in self.batches:
+                    if self._report_interval:
+                        self._count_loss(self.batches[key], unrecovered=True)
                     del self.batches[key]
                 del self._batch_timestamps[key]
+        for key in expired:
+            logging.debug(f"PerfectSocket: batch {key} timeout, removed from memory.")
+
+    def _expire_peers(self):
+        """
+        Forget the senders not heard from within batch_timeout, they stop getting reports.
+        """
+        now = self._clock.time()
+        with self._state_lock:
+            gone = [
+                client_id
+                for client_id, peer in self._report_peers.items()
+                if now - peer["last_seen"] > self._batch_timeout
+            ]
+            self._forget_peers(gone)
+
+    def _forget_peers(self, client_ids):
+        """
+        Drop the per-sender state of senders that left, called with the state lock held.
+        """
+        for client_id in client_ids:
+            peer = self._report_peers.pop(client_id)
+            self._stat_peer_lost += peer["lost"]
+            self._clock_peers.pop(client_id, None)  # No more clock probes
+            for stream in self._streams.values():
+                stream._last_batch.pop(client_id, None)
+            logging.debug(f"PerfectSocket: forgot sender {client_id:#010x}")
+
+    def _mark_processed(self, key):
+        """
+        Mark a batch as processed and release its fragments.
+        """
+        if len(self.processed_batches) == self.processed_batches.maxlen:
+            # Keep processed_batches and _processed_set in sync
+            self._processed_set.discard(self.processed_batches[0])
+        self._processed_set.add(key)
+        self.processed_batches.append(key)
+        if key in self.batches:
+            del self.batches[key]
+        if key in self._batch_timestamps:
+            del self._batch_timestamps[key]
+
+    def _cache_packets(self, batch_id, address, data, packets):
+        """
+        Keep the packets of a sent batch to answer NACKs, evicting the oldest batch.
+        """
+        with self._retransmit_lock:
+            self._retransmit_cache[batch_id] = (address, data, packets)
+            while len(self._retransmit_cache) > self._retransmit_cache_size:
+                self._retransmit_cache.popitem(last=False)
+
+    def _handle_nack(self, packet):
+        """
+        Retransmit the fragments requested by a NACK from the retransmit cache.
+        """
+        if len(packet) < NACK_HEADER.size:
+            self._drop_malformed(packet, "short NACK")
+            return
+        _, client_id, batch_id, count = NACK_HEADER.unpack_from(packet)
+        if client_id != self._client_id:
+            return
+        self._stat_nack_recv += 1
+        with self._retransmit_lock:
+            entry = self._retransmit_cache.get(batch_id)
+        if entry is None:
+            self._stat_retransmit_miss += 1
+            logging.debug(
+                f"PerfectSocket: NACK for batch_id={batch_id} not in retransmit cache, total_miss={self._stat_retransmit_miss}"
+            )
+            return
+        address, data, packets = entry
+        missing = packet[NACK_HEADER.size : NACK_HEADER.size + count]
+        for idx in missing:
+            if idx < len(packets) and self._send_fragment(
+                packets[idx], address, data, self._send_retry
+            ):
+                self._stat_retransmit += 1
+        logging.debug(
+            f"PerfectSocket: retransmitted {len(missing)} fragments of batch_id={batch_id}, total_retransmit={self._stat_retransmit}"
+        )
+
+    def _nack_stalled(self):
+        """
+        NACK the fragments partial batches that stopped making progress still need to decode.
+        """
+        now = self._clock.time()
+        nacks = []
+        with self._state_lock:
+            for key, batch in self.batches.items():
+                if batch["nacks"] >= self._nack_retries:
+                    continue
+                if (
+                    now - max(batch["last_seen"], batch["last_nack"])
+                    < self._nack_deadline
+                ):
+                    continue
+                # Only as many as the batch still needs, primary blocks first,
+                # the next retry asks again if retransmissions get lost too
+                needed = batch["k"] - len(batch["fragments"])
+                fragments = batch["fragments"]
+                missing = [i for i in range(batch["n"]) if i not in fragments][:needed]
+                batch["nacks"] += 1
+                batch["last_nack"] = now
+                nacks.append((key, batch["addr"], missing))
+        for (client_id, batch_id), addr, missing in nacks:
+            header = NACK_HEADER.pack(PKT_NACK, client_id, batch_id, len(missing))
+            try:
+                self.sock.sendto(header + bytes(missing), addr)
+            except OSError as e:
                 logging.debug(
-                    f"PerfectSocket: batch {key} timeout, removed from memory."
+                    f"PerfectSocket: NACK for batch {(client_id, batch_id)} failed: {e}"
                 )
+                continue
+            self._stat_nack_sent += 1
+            logging.debug(
+                f"PerfectSocket: NACK batch {(client_id, batch_id)}, missing={len(missing)}, total_nack={self._stat_nack_sent}"
+            )
 
+    def _needs_tick(self):
+        """
+        Check whether the reactor has periodic work for this socket.
+        """
+        return self._feedback or bool(self.batches)
+
+    def _tick(self):
+        """
+        Reactor callback, every tick: expire and shed partial batches, NACK
+        stalled ones, probe peer clocks and send reports.
+        """
+        if self._detached:
+            return
+        now = self._clock.time()
+        if now - self._last_expire_time >= min(1.0, self._batch_timeout / 10):
+            self._last_expire_time = now
+            self._expire_batches()
+            self._expire_peers()
+        if self._max_partial_batches and len(self.batches) > self._max_partial_batches:
+            self._shed_partial_batches()
+        # NACKs add load on both ends, don't send any while overloaded
+        if self._nack_deadline and not self._overloaded():
+            self._nack_stalled()
+        if self._trace_latency:
+            self._probe_clocks()
+        if self._report_interval:
+            self._send_reports()
+
+    def _track_loss(self, peer, client_id, batch_id, n):
+        """
+        Add the fragments lost by the batch a sender moved on from to its report counters.
+
+        Senders send the fragments of a batch back to back, so once a newer
+        batch arrives every fragment of the previous one not received was
+        lost, even if the batch never completes. Retransmissions of older
+        batches don't move the sender on. While overloaded, the batch moved
+        on from is shed if it is still partial.
+        """
+        current = peer["batch"]
+        if batch_id == current:
+            peer["batch_received"] += 1
+            return
+        if current is not None:
+            if not 0 < (batch_id - current) & 0xFFFFFFFF < 0x80000000:
+                return
+            peer["lost"] += max(0, peer["batch_n"] - peer["batch_received"])
+            if (client_id, current) in self.batches and self._overloaded():
+                self._shed((client_id, current))
+        peer["batch"], peer["batch_n"], peer["batch_received"] = batch_id, n, 1
+
+    def _count_loss(self, batch, unrecovered=False):
+        """
+        Count a completed or expired batch as repaired or unrecovered in the report counters of its sender.
+        """
+        peer = self._report_peers.get(batch["client_id"])
+        if peer is None:
+            return
+        fragments = batch["fragments"]
+        if unrecovered:
+            peer["unrecovered"] += 1
+        elif any(i not in fragments for i in range(batch["k"])):
+            peer["repaired"] += 1
+
+    def _send_reports(self):
+        """
+        Send a feedback report to every sender, every report_interval.
+        """
+        now = self._clock.monotonic()
+        if now - self._last_report_time < self._report_interval:
+            return
+        self._last_report_time = now
+        for client_id, peer in list(self._report_peers.items()):
+            report = REPORT_HEADER.pack(
+                PKT_REPORT,
+                client_id,
+                peer["received"] & 0xFFFFFFFF,
+                peer["lost"] & 0xFFFFFFFF,
+                peer["repaired"] & 0xFFFFFFFF,
+                peer["unrecovered"] & 0xFFFFFFFF,
+            )
             try:
-                packet, addr = self.sock.recvfrom(65535)
-            except (OSError, socket.error):
-                raise RuntimeError("PerfectSocket is closed, cannot recvfrom.")
-            header = packet[:13]
-            client_id, batch_id, idx, k, n, orig_len = struct.unpack(">IIBBBH", header)
-            fragment = packet[13:]
+                self.sock.sendto(report, peer["addr"])
+            except OSError as e:
+                logging.debug(f"PerfectSocket: report to {peer['addr']} failed: {e}")
 
-            key = (client_id, batch_id)
+    def _handle_report(self, packet):
+        """
+        Feed a receiver report to the congestion controller.
+        """
+        if len(packet) < REPORT_HEADER.size:
+            self._drop_malformed(packet, "short report")
+            return
+        if not self._cc:
+            return
+        _, client_id, received, lost, repaired, unrecovered = REPORT_HEADER.unpack_from(
+            packet
+        )
+        if client_id == self._client_id:
+            self._cc.on_report(received, lost, repaired, unrecovered)
 
-            if key in self._processed_set:
+    def _probe_clocks(self):
+        """
+        Send a clock probe to every timestamping peer due for one.
+        """
+        now = self._clock.monotonic()
+        for peer in list(self._clock_peers.values()):
+            addr, _, last_probe = peer
+            if now - last_probe < self._clock_sync_interval:
+                continue
+            peer[2] = now
+            request = CLOCK_HEADER.pack(PKT_CLOCK_REQ, 0, self._clock.monotonic_ns(), 0)
+            try:
+                self.sock.sendto(request, addr)
+            except OSError as e:
+                logging.debug(f"PerfectSocket: clock probe to {addr} failed: {e}")
+
+    def _handle_clock(self, packet, addr):
+        """
+        Answer a clock probe, or add the sample of a probe response.
+        """
+        if len(packet) < CLOCK_HEADER.size:
+            self._drop_malformed(packet, "short clock packet")
+            return
+        ptype, client_id, t1, t2 = CLOCK_HEADER.unpack_from(packet)
+        if ptype == PKT_CLOCK_REQ:
+            response = CLOCK_HEADER.pack(
+                PKT_CLOCK_RESP, self._client_id, t1, self._clock.monotonic_ns()
+            )
+            try:
+                self.sock.sendto(response, addr)
+            except OSError as e:
+                logging.debug(f"PerfectSocket: clock response to {addr} failed: {e}")
+            return
+        peer = self._clock_peers.get(client_id)
+        if peer:
+            peer[1].add_sample(t1, t2, self._clock.monotonic_ns())
+
+    def _drop_malformed(self, packet, reason):
+        """
+        Count a received packet dropped as malformed.
+        """
+        self._stat_malformed += 1
+        logging.debug(
+            f"PerfectSocket: dropped malformed packet ({len(packet)} bytes, {reason}), total_malformed={self._stat_malformed}"
+        )
+
+    def _on_readable(self):
+        """
+        Reactor callback: drain the socket buffer, decode every batch it
+        completed together and wake up the receivers.
+        """
+        if self._detached:
+            return
+        completed = []
+        burst = 0  # Approximate receive buffer memory the drained packets used
+        dropped = 0
+        for _ in range(RECV_DRAIN_MAX):
+            try:
+                if self._poll_reads and not select.select([self.sock], [], [], 0)[0]:
+                    break
+                if self._rxq_ovfl:
+                    packet, ancdata, _, addr = self.sock.recvmsg(
+                        65535, _RXQ_OVFL_SPACE, _MSG_DONTWAIT
+                    )
+                    for level, ctype, cdata in ancdata:
+                        if level == socket.SOL_SOCKET and ctype == SO_RXQ_OVFL:
+                            dropped += self._on_kernel_drops(
+                                *_RXQ_OVFL_COUNTER.unpack_from(cdata)
+                            )
+                else:
+                    packet, addr = self.sock.recvfrom(65535, _MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionRefusedError:
+                continue  # ICMP port unreachable for an earlier send
+            except OSError:
+                break  # Socket closed
+            burst += len(packet) + RCVBUF_PACKET_OVERHEAD
+            try:
+                batch = self._handle_packet(packet, addr)
+            except Exception as e:
+                # Never lose the batches this drain already completed
+                self._drop_malformed(packet, f"{type(e).__name__}: {e}")
                 continue
+            if batch:
+                completed.append(batch)
+        if self._max_rcvbuf and burst:
+            self._size_rcvbuf(burst, dropped)
+        if completed:
+            self._decode_batches(completed)
+
+    def _overloaded(self):
+        """
+        Check whether the kernel or a full receive queue dropped data in the last OVERLOAD_HOLD seconds.
+        """
+        return self._clock.monotonic() < self._overload_until
+
+    def _on_kernel_drops(self, counter):
+        """
+        Count datagrams dropped on a full receive buffer and enter overload mode.
+
+        Args:
+            counter (int): SO_RXQ_OVFL counter, the total number of drops so far.
 
-            if key not in self.batches:
-                self.batches[key] = {"k": k, "n": n, "fragments": {}}
-                self._batch_timestamps[key] = time.time()
+        Returns:
+            int: Number of datagrams dropped since the previous counter.
+        """
+        count = (counter - self._kernel_drops) & 0xFFFFFFFF
+        if not count:
+            return 0
+        self._kernel_drops = counter
+        self._stat_kernel_drop += count
+        self._enter_overload(f"receive buffer overflow, {count} datagrams dropped")
+        return count
+
+    def _enter_overload(self, reason):
+        """
+        Shed load for the next OVERLOAD_HOLD seconds, warning when entering overload mode.
+        """
+        if not self._overloaded():
+            logging.warning(f"PerfectSocket: {reason}, shedding load.")
+        self._overload_until = self._clock.monotonic() + OVERLOAD_HOLD
+
+    def _size_rcvbuf(self, burst, dropped):
+        """
+        Grow SO_RCVBUF when a burst filled half of it or the kernel dropped
+        datagrams, to four times the burst (at least double), up to max_rcvbuf.
+        """
+        if self._rcvbuf_capped:
+            return
+        if self._rcvbuf is None:
+            self._rcvbuf = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if not dropped and burst * 2 <= self._rcvbuf:
+            return
+        target = min(self._max_rcvbuf, max(self._rcvbuf * 2, burst * 4))
+        if target <= self._rcvbuf:
+            self._rcvbuf_capped = True
+            return
+        # Linux doubles the value set (bookkeeping overhead), getsockopt returns the doubled one
+        value = target // 2 if _LINUX else target
+        for option in (SO_RCVBUFFORCE, socket.SO_RCVBUF):
+            if option is None:
+                continue
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, option, value)
+                break
+            except OSError:
+                continue  # SO_RCVBUFFORCE without CAP_NET_ADMIN
+        try:
+            rcvbuf = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        except OSError:
+            return  # Socket closed
+        if rcvbuf <= self._rcvbuf:
+            self._rcvbuf_capped = True
+            logging.warning(
+                f"PerfectSocket: SO_RCVBUF capped at {rcvbuf} bytes, raise net.core.rmem_max for bursts of {burst} bytes."
+            )
+            return
+        logging.debug(f"PerfectSocket: SO_RCVBUF {self._rcvbuf} -> {rcvbuf} bytes.")
+        self._rcvbuf = rcvbuf
+
+    def _shed(self, key):
+        """
+        Drop a partial batch (or one not seen yet) and skip its later fragments, called with _state_lock held.
+        """
+        batch = self.batches.get(key)
+        if batch is not None and self._report_interval:
+            self._count_loss(batch, unrecovered=True)
+        self._mark_processed(key)
+        self._stat_shed += 1
+        logging.debug(f"PerfectSocket: shed batch {key}, total_shed={self._stat_shed}")
+
+    def _shed_partial_batches(self):
+        """
+        Shed partial batches beyond max_partial_batches, keeping the ones closest to k (then the newest).
+        """
+        with self._state_lock:
+            ranked = sorted(
+                self.batches,
+                key=lambda key: (
+                    self.batches[key]["k"] - len(self.batches[key]["fragments"]),
+                    -self._batch_timestamps.get(key, 0),
+                ),
+            )
+            for key in ranked[self._max_partial_batches :]:
+                self._shed(key)
+
+    def _handle_packet(self, packet, addr):
+        """
+        Dispatch a packet by type, storing data fragments into their batch.
+
+        Returns:
+            tuple: (key, batch) when a batch just reached k fragments, otherwise None.
+        """
+        if not packet:
+            return None
+        ptype = packet[0] & TYPE_MASK
+        if ptype == PKT_NACK:
+            self._handle_nack(packet)
+            return None
+        if ptype in (PKT_CLOCK_REQ, PKT_CLOCK_RESP):
+            self._handle_clock(packet, addr)
+            return None
+        if ptype == PKT_REPORT:
+            self._handle_report(packet)
+            return None
+        if ptype != PKT_DATA:
+            return None
+        offset = DATA_HEADER.size
+        if packet[0] & FLAG_TIMESTAMP:
+            offset += TIMESTAMP_EXT.size
+        if len(packet) < offset:
+            self._drop_malformed(packet, "short data packet")
+            return None
+        _, stream_id, client_id, batch_id, idx, k, n, orig_len = (
+            DATA_HEADER.unpack_from(packet)
+        )
+        if not 0 < k <= n or idx >= n:
+            self._drop_malformed(packet, f"idx={idx}, k={k}, n={n}")
+            return None
+        sent_at = None
+        if packet[0] & FLAG_TIMESTAMP:
+            (sent_at,) = TIMESTAMP_EXT.unpack_from(packet, DATA_HEADER.size)
+        fragment = packet[offset:]
+
+        key = (client_id, batch_id)
+        now = self._clock.time()
+
+        with self._state_lock:
+            # Counted for every sender, reported with report_interval
+            peer = self._report_peers.get(client_id)
+            if peer is None:
+                if len(self._report_peers) >= MAX_PEERS:
+                    self._forget_peers(
+                        [
+                            min(
+                                self._report_peers,
+                                key=lambda c: self._report_peers[c]["last_seen"],
+                            )
+                        ]
+                    )
+                peer = self._report_peers[client_id] = {
+                    "addr": addr,
+                    "received": 0,
+                    "lost": 0,
+                    "repaired": 0,
+                    "unrecovered": 0,
+                    "batch": None,  # Batch the sender is sending, see _track_loss
+                    "batch_n": 0,
+                    "batch_received": 0,
+                    "last_seen": now,
+                }
+            peer["received"] += 1
+            peer["last_seen"] = now
+            self._track_loss(peer, client_id, batch_id, n)
+            if key in self._processed_set:
+                return None
+            if stream_id not in self._streams:
+                # Nobody reads the stream, don't reassemble it
+                self._mark_processed(key)
+                self._stat_unknown_stream += 1
+                return None
+
+            batch = self.batches.get(key)
+            # Fragments are sent in index order, so while overloaded skip the
+            # batches that can't reach k even if all the remaining ones arrive
+            if (
+                self._overload_until
+                and (len(batch["fragments"]) if batch else 0) + n - idx < k
+                and self._overloaded()
+            ):
+                self._shed(key)
+                return None
+
+            if batch is None:
+                self.batches[key] = {
+                    "client_id": client_id,
+                    "stream": stream_id,
+                    "k": k,
+                    "n": n,
+                    "orig_len": orig_len,
+                    "addr": addr,
+                    "fragments": {},
+                    "last_seen": now,
+                    "last_nack": 0,
+                    "nacks": 0,
+                    "sent_at": sent_at,
+                    "compressed": bool(packet[0] & FLAG_COMPRESSED),
+                }
+                self._batch_timestamps[key] = now
+                if self._profiler:
+                    self._profiler(STAGE_FIRST_IN, key, self._clock.monotonic())
+                if sent_at is not None and self._trace_latency:
+                    if client_id not in self._clock_peers:
+                        self._clock_peers[client_id] = [addr, ClockOffsetEstimator(), 0]
 
             batch = self.batches[key]
+            if (batch["k"], batch["n"]) != (k, n):
+                self._drop_malformed(packet, f"k={k}, n={n} differ from the batch")
+                return None
             batch["fragments"][idx] = fragment
+            batch["last_seen"] = now
 
-            # Try to decode when k fragments are collected
-            if len(batch["fragments"]) >= batch["k"]:
-                fragment_ids = list(batch["fragments"].keys())
-                fragment_datas = [batch["fragments"][i] for i in fragment_ids]
-                try:
-                    decoder = Decoder(batch["k"], batch["n"])
-                    decoded_data = decoder.decode(fragment_datas, fragment_ids)
-                    data_bytes = b"".join(decoded_data)[:orig_len]
-                except Exception as e:
+            if len(batch["fragments"]) < batch["k"]:
+                return None
+            # k fragments collected, the batch is ready to decode
+            self._mark_processed(key)
+            if self._report_interval:
+                self._count_loss(batch)
+        if batch["nacks"]:
+            self._stat_nack_recovered += 1
+        return key, batch
+
+    def _decode_batches(self, completed):
+        """
+        Decode completed batches, grouping same-(k, n) batches into one decoder call,
+        and deliver them to their stream.
+
+        Args:
+            completed (list): List of (key, batch) returned by _handle_packet.
+        """
+        groups = {}
+        for key, batch in completed:
+            groups.setdefault((batch["k"], batch["n"]), []).append((key, batch))
+        decoded = {}
+        for (k, n), group in groups.items():
+            if self._profiler:
+                self._profile_batches(STAGE_DECODE_START, group)
+            stripes = [batch["fragments"] for _, batch in group]
+            results = decode_stripes(k, n, stripes)
+            if self._profiler:
+                self._profile_batches(STAGE_DECODE_END, group)
+            for (key, batch), result in zip(group, results):
+                if not isinstance(result, Exception):
+                    result = self._unpack_batch(batch, result)
+                if isinstance(result, Exception):
                     self._stat_decode_fail += 1
+                    if self._report_interval:
+                        with self._state_lock:
+                            peer = self._report_peers.get(key[0])
+                            if peer:
+                                peer["unrecovered"] += 1
                     if self._on_decode_error:
-                        self._on_decode_error(e, key)
+                        self._on_decode_error(result, key)
                     else:
                         logging.error(
-                            f"PerfectSocket: decode failed for batch {key}: {e}"
+                            f"PerfectSocket: decode failed for batch {key}: {result}"
                         )
                     logging.debug(
                         f"PerfectSocket: decode failed, batch_id={key}, total_decode_fail={self._stat_decode_fail}"
                     )
-                    # Mark as processed and clean up
-                    self._processed_set.add(key)
-                    self.processed_batches.append(key)
-                    if key in self.batches:
-                        del self.batches[key]
-                    if key in self._batch_timestamps:
-                        del self._batch_timestamps[key]
                     continue
                 self._stat_recv_batch += 1
                 logging.debug(
-                    f"PerfectSocket: received batch_id={key}, k={batch['k']}, n={batch['n']}, total_recv={self._stat_recv_batch}"
+                    f"PerfectSocket: received batch_id={key}, k={k}, n={n}, total_recv={self._stat_recv_batch}"
                 )
-                # Mark as processed and clean up
-                self._processed_set.add(key)
-                self.processed_batches.append(key)
-                if key in self.batches:
-                    del self.batches[key]
-                if key in self._batch_timestamps:
-                    del self._batch_timestamps[key]
-                # Keep processed_batches and _processed_set in sync
-                while len(self.processed_batches) > self.processed_batches.maxlen:
-                    old = self.processed_batches.popleft()
-                    self._processed_set.discard(old)
-                return data_bytes, addr
+                decoded[key] = (result, batch["addr"])
+        # Deliver in completion order
+        with self._recv_cond:
+            for key, batch in completed:
+                if key not in decoded:
+                    continue
+                stream = self._streams[batch["stream"]]
+                if not stream._accept(*key):
+                    continue
+                if not stream._deliver(decoded[key]):
+                    # The application reads slower than data arrives
+                    self._enter_overload(
+                        f"stream {stream.stream_id} receive queue full, oldest messages dropped"
+                    )
+                if self._profiler:
+                    self._profiler(STAGE_DELIVER, key, self._clock.monotonic())
+                if self.latency_histogram and batch["sent_at"] is not None:
+                    self._record_latency(key[0], batch["sent_at"])
+            self._recv_cond.notify_all()
+
+    def _unpack_batch(self, batch, result):
+        """
+        Strip the padding of decoded data and decompress it, returns the exception if that fails.
+        """
+        data = result[: batch["orig_len"]]
+        if not batch["compressed"]:
+            return data
+        try:
+            return self._streams[batch["stream"]]._decompress(data)
+        except Exception as e:
+            return e
+
+    def _profile_batches(self, stage, group):
+        """
+        Call the profiling hook for a group of received batches.
+        """
+        now = self._clock.monotonic()
+        for key, _ in group:
+            self._profiler(stage, key, now)
+
+    def _record_latency(self, client_id, sent_at):
+        """
+        Add the one-way latency of a delivered batch, once the sender clock offset is known.
+        """
+        peer = self._clock_peers.get(client_id)
+        offset = peer[1].offset if peer else None
+        if offset is None:
+            return
+        self.latency_histogram.add(
+            (self._clock.monotonic_ns() - (sent_at - offset)) / 1e9
+        )
+
+    def _recv(self, stream, max_count, timeout):
+        """
+        Wait until the reactor delivered decoded data to the stream.
+
+        Args:
+            stream (PerfectStream): Stream to receive from.
+            max_count (int): Max number of messages to return.
+            timeout (float): Timeout in seconds, None for unlimited.
+
+        Returns:
+            list: List of (data_bytes, addr), oldest first.
+        """
+        if self._closed:
+            raise RuntimeError("PerfectSocket is closed, cannot recvfrom.")
+        self._activate()
+        deadline = None if timeout is None else self._clock.monotonic() + timeout
+        with self._recv_cond:
+            while not stream._ready:
+                if self._closed:
+                    raise RuntimeError("PerfectSocket is closed, cannot recvfrom.")
+                remaining = (
+                    None if deadline is None else deadline - self._clock.monotonic()
+                )
+                if remaining is not None and remaining <= 0:
+                    raise socket.timeout("timed out")
+                self._wait(self._recv_cond, remaining)
+            count = min(max_count, len(stream._ready))
+            return [stream._ready.popleft() for _ in range(count)]
+
+    def recvfrom(self, timeout=None):
+        """
+        Receive data on stream 0 (blocking until a complete batch is received).
+
+        Args:
+            timeout (float): Timeout in seconds, None for unlimited.
+
+        Returns:
+            (data_bytes, addr): Decoded data and source address.
+        """
+        return self._recv(self._streams[0], 1, timeout)[0]
+
+    def recvfrom_many(self, max_count=64, timeout=None):
+        """
+        Receive several messages on stream 0 at once (blocking until at least one is received).
+
+        The reactor drains the socket buffer on every wake up and decodes
+        every batch it completed together, this returns all of them at once.
+
+        Args:
+            max_count (int): Max number of messages to return.
+            timeout (float): Timeout in seconds, None for unlimited.
+
+        Returns:
+            list: List of (data_bytes, addr), oldest first.
+        """
+        return self._recv(self._streams[0], max_count, timeout)
+
+    def stats(self):
+        """
+        Return the socket statistics as a dict.
+
+        Received fragments that never arrived are split into lost_local, the
+        datagrams the kernel dropped on a full receive buffer (SO_RXQ_OVFL,
+        Linux only), and lost_network, the rest (approximately, the kernel
+        counter also includes feedback packets).
+        """
+        with self._state_lock:
+            lost = self._stat_peer_lost + sum(
+                peer["lost"] for peer in self._report_peers.values()
+            )
+        return {
+            "sent": self._stat_send_batch,
+            "recv": self._stat_recv_batch,
+            "dropped": self._stat_send_drop,
+            "decode_fail": self._stat_decode_fail,
+            "lost_local": self._stat_kernel_drop,
+            "lost_network": max(0, lost - self._stat_kernel_drop),
+            "shed": self._stat_shed,
+            "recv_dropped": sum(s._stat_recv_drop for s in self._streams.values()),
+            "unknown_stream": self._stat_unknown_stream,
+            "malformed": self._stat_malformed,
+            "partial_batches": len(self.batches),
+            "overloaded": self._overloaded(),
+            "rcvbuf": self._rcvbuf,
+        }
 
     def close(self, wait_queue=True, timeout=None):
         """
@@ -318,17 +1676,26 @@ class PerfectSocket:
         if self._closed:
             return
         self._closed = True
-        self._stop_event.set()
         if wait_queue:
-            start_time = time.time()
-            while self._send_thread.is_alive():
-                self._send_thread.join(timeout=0.1)
-                if timeout is not None and (time.time() - start_time) > timeout:
-                    break
+            deadline = None if timeout is None else self._clock.monotonic() + timeout
+            with self._unsent_cond:
+                while self._unsent > 0:
+                    remaining = (
+                        None if deadline is None else deadline - self._clock.monotonic()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._wait(self._unsent_cond, remaining)
+        with self._register_lock:
+            if self._registered:
+                self._reactor.unregister(self)
+            self._detached = True
         try:
             self.sock.close()
         except Exception:
             pass
+        with self._recv_cond:
+            self._recv_cond.notify_all()  # Wake up blocked recvfrom calls
         # Print statistics summary
         if logging.getLogger().isEnabledFor(logging.DEBUG):
             avg_delay = (
@@ -340,7 +1707,20 @@ class PerfectSocket:
                 f"PerfectSocket stats: sent={self._stat_send_batch}, "
                 f"recv={self._stat_recv_batch}, dropped={self._stat_send_drop}, "
                 f"queue_full={self._stat_queue_full}, send_fail={self._stat_send_fail}, "
-                f"decode_fail={self._stat_decode_fail}, avg_send_delay={avg_delay:.4f}s"
+                f"decode_fail={self._stat_decode_fail}, avg_send_delay={avg_delay:.4f}s, "
+                f"nack_sent={self._stat_nack_sent}, nack_recv={self._stat_nack_recv}, "
+                f"nack_recovered={self._stat_nack_recovered}, retransmit={self._stat_retransmit}, "
+                f"retransmit_miss={self._stat_retransmit_miss}, "
+                f"kernel_drop={self._stat_kernel_drop}, shed={self._stat_shed}"
+            )
+        if self._cc:
+            logging.debug(
+                f"PerfectSocket congestion control: rate={self._cc.rate:.0f}B/s, "
+                f"reports={self._cc.stat_reports}, congestion={self._cc.stat_congestion}"
+            )
+        if self.latency_histogram and self.latency_histogram.count:
+            logging.debug(
+                f"PerfectSocket one-way latency: {self.latency_histogram.summary()}"
             )
 
     def _next_batch_id(self):
@@ -8,7 +8,7 @@ import threading
 import time
 
 
-def worker(host_ip, host_port, dst_ip, dst_port, loss_rate):
+def worker(host_ip, host_port, dst_ip, dst_port, loss_rate, client_addr):
     q = queue.Queue(maxsize=10000)
 
     def receiver(sock):
@@ -16,16 +16,28 @@ def worker(host_ip, host_port, dst_ip, dst_port, loss_rate):
             data, addr = sock.recvfrom(65535)
             if random.random() < loss_rate:
                 continue
+            if addr == (dst_ip, dst_port):
+                # Feedback from the server (e.g. NACKs), relay it back to the client
+                port = int.from_bytes(client_addr[4:6], "big")
+                if port == 0:
+                    continue
+                dest = (socket.inet_ntoa(bytes(client_addr[:4])), port)
+            else:
+                # Remember the client, shared by all workers
+                packed = socket.inet_aton(addr[0]) + addr[1].to_bytes(2, "big")
+                if bytes(client_addr) != packed:
+                    client_addr[:] = packed
+                dest = (dst_ip, dst_port)
             try:
-                q.put(data, timeout=0.01)
+                q.put((data, dest), timeout=0.01)
             except queue.Full:
                 continue
 
     def sender(sock):
         while True:
             try:
-                data = q.get(timeout=0.01)
-                sock.sendto(data, (dst_ip, dst_port))
+                data, dest = q.get(timeout=0.01)
+                sock.sendto(data, dest)
             except queue.Empty:
                 continue
 
@@ -51,6 +63,7 @@ if __name__ == "__main__":
     parser.add_argument("--dst-port", type=int, default=5405)
     parser.add_argument("--loss-rate", type=float, default=0.1)
     args = parser.parse_args()
+    client_addr = multiprocessing.Array("B", 6, lock=False)  # ip (4 bytes) + port
     procs = []
     for _ in range(os.cpu_count()):
         p = multiprocessing.Process(
@@ -61,6 +74,7 @@ if __name__ == "__main__":
                 args.dst_ip,
                 args.dst_port,
                 args.loss_rate,
+                client_addr,
             ),
         )
         p.start()
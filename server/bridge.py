@@ -0,0 +1,395 @@
+import argparse
+import logging
+import queue
+import select
+import signal
+import socket
+import threading
+import time
+
+from psocket import PerfectSocket
+
+MODE_ENCODE = "encode"  # Plain UDP in, PerfectSocket out
+MODE_DECODE = "decode"  # PerfectSocket in, plain UDP out
+
+
+def parse_endpoint(value):
+    """
+    Parse a "host:port" string into a (host, port) tuple.
+    """
+    host, _, port = value.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(
+            f"invalid endpoint {value!r}, expected host:port"
+        )
+    return host, int(port)
+
+
+class Bridge:
+    """
+    A UDP <-> PerfectSocket bridge daemon.
+
+    Datagrams go through a pipeline of threads connected by bounded queues:
+    ingress (batched recv) -> FEC (PerfectSocket encode or decode) -> egress.
+    """
+
+    def __init__(
+        self,
+        mode,
+        listen,
+        forward,
+        queue_size=1024,
+        recv_batch=64,
+        stats_interval=5.0,
+        drain_timeout=5.0,
+        redundancy_ratio=None,
+        uep=False,
+        socket_options=None,
+    ):
+        """
+        Initialize Bridge.
+
+        Args:
+            mode (str): MODE_ENCODE or MODE_DECODE.
+            listen (list): (host, port) to listen on, several for MODE_ENCODE, one for MODE_DECODE.
+            forward (tuple): (host, port) to forward to.
+            queue_size (int): Max number of datagram batches between two pipeline stages.
+            recv_batch (int): Max number of datagrams received per wake up.
+            stats_interval (float): Seconds between aggregated stats logs, 0 to disable.
+            drain_timeout (float): Max seconds to wait for queued data on shutdown.
+            redundancy_ratio (int): Redundancy ratio for MODE_ENCODE, None for the PerfectSocket default.
+            uep (bool): Pick the redundancy ratio per datagram from its MPEG-TS content (MODE_ENCODE).
+            socket_options (dict): Extra keyword arguments for PerfectSocket.
+        """
+        if mode not in (MODE_ENCODE, MODE_DECODE):
+            raise ValueError(f"Bridge: unknown mode {mode!r}.")
+        if mode == MODE_DECODE and len(listen) != 1:
+            raise ValueError("Bridge: decode mode listens on exactly one endpoint.")
+        self.mode = mode
+        self.listen = list(listen)
+        self.forward = forward
+        self._recv_batch = recv_batch
+        self._stats_interval = stats_interval
+        self._drain_timeout = drain_timeout
+        self._redundancy_ratio = redundancy_ratio
+        self._socket_options = socket_options or {}
+
+        self._queue = queue.Queue(maxsize=queue_size)  # Batches between stages
+        self._stop_event = threading.Event()  # Stop ingress
+        self._ingress_done = threading.Event()  # Ingress stopped, drain the rest
+        self._threads = []
+        self._udp_socks = []
+        self._ps = None
+
+        self._classifiers = {}
+        if uep:
+            from mpegts import TsClassifier
+
+            self._classifier_cls = TsClassifier
+        else:
+            self._classifier_cls = None
+
+        # Statistics
+        self._stat_lock = threading.Lock()
+        self._stat_in_packets = 0
+        self._stat_in_bytes = 0
+        self._stat_out_packets = 0
+        self._stat_out_bytes = 0
+        self._stat_queue_drop = 0
+        self._stat_filtered = 0
+        self._stat_oversize = 0
+
+    def start(self):
+        """
+        Open the sockets and start the pipeline threads.
+        """
+        self._started_at = time.time()
+        if self.mode == MODE_ENCODE:
+            for addr in self.listen:
+                s = self._udp_socket()
+                s.bind(addr)
+                s.setblocking(False)
+                self._udp_socks.append(s)
+            self._ps = PerfectSocket(**self._socket_options)
+            stages = [self._udp_ingress, self._encode_stage]
+        else:
+            self._udp_socks.append(self._udp_socket())
+            self._ps = PerfectSocket(self.listen[0], **self._socket_options)
+            stages = [self._decode_ingress, self._udp_egress]
+        self._ps.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._ps.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+        if self._stats_interval:
+            stages.append(self._stats_worker)
+        for stage in stages:
+            t = threading.Thread(target=stage, name=stage.__name__, daemon=True)
+            t.start()
+            self._threads.append(t)
+        logging.info(
+            f"Bridge: {self.mode} {', '.join(f'{h}:{p}' for h, p in self.listen)} "
+            f"-> {self.forward[0]}:{self.forward[1]}"
+        )
+
+    def stop(self):
+        """
+        Stop receiving, drain the queued data and close the sockets.
+        """
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        deadline = time.time() + self._drain_timeout
+        for t in self._threads:
+            t.join(timeout=max(0, deadline - time.time()))
+        if self._ps:
+            self._ps.close(timeout=max(0, deadline - time.time()))
+        for s in self._udp_socks:
+            s.close()
+        self._log_stats(self._stats_snapshot(), time.time() - self._started_at)
+
+    def run(self):
+        """
+        Run until SIGINT / SIGTERM, then drain gracefully.
+        """
+        self.start()
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        while not stop.wait(0.5):
+            pass
+        logging.info("Bridge: shutting down, draining queues.")
+        self.stop()
+
+    def _udp_socket(self):
+        """
+        Create a plain UDP socket with large buffers.
+        """
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+        return s
+
+    def _put(self, source, batch):
+        """
+        Hand a batch to the next stage, dropping it if the stage can't keep up.
+        """
+        try:
+            self._queue.put((source, batch), timeout=0.1)
+        except queue.Full:
+            with self._stat_lock:
+                self._stat_queue_drop += len(batch)
+
+    def _get(self):
+        """
+        Take a batch from the previous stage.
+
+        Returns:
+            tuple: (source, batch), or None once ingress stopped and the queue is drained.
+        """
+        while True:
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._ingress_done.is_set():
+                    return None
+
+    def _udp_ingress(self):
+        """
+        Ingress stage (encode): batched recv from all listen sockets.
+        """
+        try:
+            while not self._stop_event.is_set():
+                readable, _, _ = select.select(self._udp_socks, [], [], 0.1)
+                for s in readable:
+                    batch = []
+                    while len(batch) < self._recv_batch:
+                        try:
+                            batch.append(s.recv(65535))
+                        except BlockingIOError:
+                            break
+                    if not batch:
+                        continue
+                    with self._stat_lock:
+                        self._stat_in_packets += len(batch)
+                        self._stat_in_bytes += sum(len(d) for d in batch)
+                    self._put(s, batch)
+        finally:
+            self._ingress_done.set()
+
+    def _encode_stage(self):
+        """
+        FEC stage (encode): hand datagrams to PerfectSocket, which encodes and sends them.
+        """
+        while True:
+            item = self._get()
+            if item is None:
+                return
+            s, batch = item
+            classifier = None
+            if self._classifier_cls:
+                classifier = self._classifiers.setdefault(s, self._classifier_cls())
+            for data in batch:
+                redundancy_ratio = self._redundancy_ratio
+                if classifier:
+                    data, tier = classifier.classify(data)
+                    if not data:
+                        with self._stat_lock:
+                            self._stat_filtered += 1
+                        continue
+                    redundancy_ratio = classifier.redundancy(tier)
+                try:
+                    if redundancy_ratio:
+                        self._ps.sendto(
+                            data, self.forward, redundancy_ratio=redundancy_ratio
+                        )
+                    else:
+                        self._ps.sendto(data, self.forward)
+                except ValueError as e:
+                    # Too large for one batch at this redundancy
+                    logging.debug(f"Bridge: datagram dropped: {e}")
+                    with self._stat_lock:
+                        self._stat_oversize += 1
+                    continue
+                with self._stat_lock:
+                    self._stat_out_packets += 1
+                    self._stat_out_bytes += len(data)
+
+    def _decode_ingress(self):
+        """
+        Ingress + FEC stage (decode): receive and decode batches with PerfectSocket.
+        """
+        try:
+            while True:
+                # Once stopping, forward what the reactor already decoded
+                stopping = self._stop_event.is_set()
+                try:
+                    received = self._ps.recvfrom_many(
+                        self._recv_batch, timeout=0 if stopping else 0.1
+                    )
+                except (RuntimeError, socket.timeout):
+                    if stopping:
+                        break  # Drained
+                    continue  # Timed out, check for shutdown
+                batch = [data for data, _ in received]
+                with self._stat_lock:
+                    self._stat_in_packets += len(batch)
+                    self._stat_in_bytes += sum(len(d) for d in batch)
+                self._put(None, batch)
+        finally:
+            self._ingress_done.set()
+
+    def _udp_egress(self):
+        """
+        Egress stage (decode): forward decoded datagrams as plain UDP.
+        """
+        s = self._udp_socks[0]
+        while True:
+            item = self._get()
+            if item is None:
+                return
+            _, batch = item
+            count = sent = 0
+            for data in batch:
+                try:
+                    s.sendto(data, self.forward)
+                    count += 1
+                    sent += len(data)
+                except OSError as e:
+                    logging.debug(f"Bridge: forward failed: {e}")
+            with self._stat_lock:
+                self._stat_out_packets += count
+                self._stat_out_bytes += sent
+
+    def _stats_snapshot(self):
+        """
+        Return the current counters.
+        """
+        with self._stat_lock:
+            stats = {
+                "in_packets": self._stat_in_packets,
+                "in_bytes": self._stat_in_bytes,
+                "out_packets": self._stat_out_packets,
+                "out_bytes": self._stat_out_bytes,
+                "queue_drop": self._stat_queue_drop,
+                "filtered": self._stat_filtered,
+                "oversize": self._stat_oversize,
+            }
+        # Fragments lost on the receive buffer vs on the network (decode)
+        ps_stats = self._ps.stats() if self._ps else {}
+        for key in ("lost_local", "lost_network", "shed"):
+            stats[key] = ps_stats.get(key, 0)
+        return stats
+
+    def _log_stats(self, stats, elapsed, previous=None):
+        """
+        Log aggregated stats, as rates since the previous snapshot if given.
+        """
+        if previous is None:
+            logging.info(f"Bridge totals: {stats}, elapsed={elapsed:.1f}s")
+            return
+        delta = {key: stats[key] - previous[key] for key in stats}
+        logging.info(
+            f"Bridge: in={delta['in_packets'] / elapsed:.0f} pkt/s "
+            f"({delta['in_bytes'] * 8 / elapsed / 1e6:.2f} Mbit/s), "
+            f"out={delta['out_packets'] / elapsed:.0f} pkt/s "
+            f"({delta['out_bytes'] * 8 / elapsed / 1e6:.2f} Mbit/s), "
+            f"queue={self._queue.qsize()}, queue_drop={delta['queue_drop']}, "
+            f"filtered={delta['filtered']}, lost_local={delta['lost_local']}, "
+            f"lost_network={delta['lost_network']}, shed={delta['shed']}"
+        )
+
+    def _stats_worker(self):
+        """
+        Periodically log aggregated stats instead of a line per packet.
+        """
+        previous = self._stats_snapshot()
+        last = time.time()
+        while not self._stop_event.wait(self._stats_interval):
+            stats = self._stats_snapshot()
+            now = time.time()
+            self._log_stats(stats, now - last, previous)
+            previous, last = stats, now
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UDP <-> PerfectSocket bridge")
+    parser.add_argument("mode", choices=[MODE_ENCODE, MODE_DECODE])
+    parser.add_argument(
+        "--listen",
+        type=parse_endpoint,
+        action="append",
+        required=True,
+        help="host:port to listen on, repeat for several ingress ports (encode)",
+    )
+    parser.add_argument("--forward", type=parse_endpoint, required=True)
+    parser.add_argument("--redundancy-ratio", type=int, default=None)
+    parser.add_argument(
+        "--uep", action="store_true", help="MPEG-TS unequal error protection (encode)"
+    )
+    parser.add_argument("--queue-size", type=int, default=1024)
+    parser.add_argument("--recv-batch", type=int, default=64)
+    parser.add_argument("--stats-interval", type=float, default=5.0)
+    parser.add_argument("--drain-timeout", type=float, default=5.0)
+    parser.add_argument("--nack-deadline", type=float, default=None)
+    parser.add_argument("--retransmit-cache-size", type=int, default=0)
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper())
+    Bridge(
+        args.mode,
+        args.listen,
+        args.forward,
+        queue_size=args.queue_size,
+        recv_batch=args.recv_batch,
+        stats_interval=args.stats_interval,
+        drain_timeout=args.drain_timeout,
+        redundancy_ratio=args.redundancy_ratio,
+        uep=args.uep,
+        socket_options={
+            "nack_deadline": args.nack_deadline,
+            "retransmit_cache_size": args.retransmit_cache_size,
+        },
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
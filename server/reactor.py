@@ -0,0 +1,274 @@
+import heapq
+import logging
+import os
+import queue
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Send scheduling states of a registered socket
+_SEND_IDLE = 0  # Nothing queued
+_SEND_QUEUED = 1  # Waiting for a worker
+_SEND_RUNNING = 2  # A worker is in _send_step
+_SEND_WAITING = 3  # Paced, waiting for its timer
+
+
+class Reactor:
+    """
+    Process-wide I/O reactor shared by PerfectSocket instances.
+
+    One selector thread watches every registered socket for readability and
+    runs the timers, a small fixed pool of workers runs the socket callbacks:
+    _send_step (send queues), _on_readable (receive) and _tick (NACKs, clock
+    probes, reports, batch expiry). A socket is never handled by two workers
+    for the same kind of work at once, so its send order and its receive
+    state stay sequential. Threads start on the first registration.
+
+    Large payloads are encoded on a separate pool (submit_encode) while the
+    workers keep transmitting, zfec releases the GIL so encode jobs run on
+    several cores.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, workers=None, tick_interval=0.01, encode_workers=None):
+        """
+        Initialize Reactor.
+
+        Args:
+            workers (int): Number of worker threads, None for min(4, cpu count).
+            tick_interval (float): Seconds between periodic ticks of each socket.
+            encode_workers (int): Number of encode pool threads, None for the cpu count.
+        """
+        self._workers = workers or min(4, os.cpu_count() or 1)
+        self._encode_workers = encode_workers or os.cpu_count() or 1
+        self._encode_pool = None
+        self._tick_interval = tick_interval
+        self._lock = threading.Lock()
+        self._started = False
+        self._threads = []
+        self._tasks = queue.SimpleQueue()  # (callback, psocket) for the workers
+        self._sockets = set()
+        self._timers = []  # Heap of (due, seq, psocket)
+        self._timer_seq = 0
+        self._arm = []  # Sockets to (re)watch for reading
+        self._disarm = []  # (psocket, event) of closing sockets to stop watching
+        self._selector = None
+        self._wakeup_r = self._wakeup_w = None
+
+    @classmethod
+    def default(cls):
+        """
+        Return the process-wide reactor, created on first use.
+        """
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def register(self, psocket):
+        """
+        Start handling a socket, starting the threads on first use.
+        """
+        with self._lock:
+            if not self._started:
+                self._start()
+            psocket._send_state = _SEND_IDLE
+            psocket._send_again = False
+            psocket._tick_pending = False
+            self._sockets.add(psocket)
+            self._arm.append(psocket)
+        self._wakeup()
+
+    def unregister(self, psocket):
+        """
+        Stop handling a socket, waits until the selector stopped watching it
+        so it can be closed (its file descriptor number may be reused).
+        """
+        done = threading.Event()
+        with self._lock:
+            if psocket not in self._sockets:
+                return
+            self._sockets.discard(psocket)
+            self._disarm.append((psocket, done))
+        self._wakeup()
+        if threading.current_thread() is not self._threads[0]:
+            done.wait(1.0)
+
+    def schedule_send(self, psocket):
+        """
+        Have a worker run the socket send step, after data was queued.
+        """
+        with self._lock:
+            if psocket._send_state == _SEND_IDLE:
+                psocket._send_state = _SEND_QUEUED
+                self._tasks.put((self._run_send, psocket))
+            elif psocket._send_state == _SEND_RUNNING:
+                psocket._send_again = True  # It may have missed the new data
+
+    def submit_encode(self, fn, *args):
+        """
+        Run fn(*args) on the encode pool, created on first use.
+
+        Returns:
+            Future: Future of the call.
+        """
+        with self._lock:
+            if self._encode_pool is None:
+                self._encode_pool = ThreadPoolExecutor(
+                    max_workers=self._encode_workers,
+                    thread_name_prefix="reactor-encode",
+                )
+        return self._encode_pool.submit(fn, *args)
+
+    def _start(self):
+        """
+        Create the selector and start the threads.
+        """
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        threads = [threading.Thread(target=self._select_loop, name="reactor")]
+        for i in range(self._workers):
+            threads.append(
+                threading.Thread(target=self._worker, name=f"reactor-worker-{i}")
+            )
+        for t in threads:
+            t.daemon = True
+            t.start()
+        self._threads = threads
+        self._started = True
+
+    def _wakeup(self):
+        """
+        Interrupt the selector so it picks up new registrations and timers.
+        """
+        try:
+            self._wakeup_w.send(b"\0")
+        except (BlockingIOError, AttributeError):
+            pass  # Already pending, or not started
+
+    def _select_loop(self):
+        """
+        Selector thread: dispatch readable sockets, due timers and ticks to the workers.
+        """
+        next_tick = time.monotonic()
+        while True:
+            with self._lock:
+                arm, self._arm = self._arm, []
+                disarm, self._disarm = self._disarm, []
+                timeout = next_tick - time.monotonic()
+                if self._timers:
+                    timeout = min(timeout, self._timers[0][0] - time.monotonic())
+            for ps, done in disarm:
+                self._unwatch(ps)
+                done.set()
+            for ps in arm:
+                if ps in self._sockets:
+                    try:
+                        self._selector.register(ps.sock, selectors.EVENT_READ, ps)
+                    except (KeyError, ValueError, OSError):
+                        pass  # Already watched, or closed
+
+            for key, _ in self._selector.select(max(0, timeout)):
+                if key.data is None:
+                    try:
+                        while self._wakeup_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                # Stop watching until a worker drained it, the selector is level triggered
+                self._unwatch(key.data)
+                self._tasks.put((self._run_readable, key.data))
+
+            now = time.monotonic()
+            with self._lock:
+                while self._timers and self._timers[0][0] <= now:
+                    _, _, ps = heapq.heappop(self._timers)
+                    if ps._send_state == _SEND_WAITING:
+                        ps._send_state = _SEND_QUEUED
+                        self._tasks.put((self._run_send, ps))
+                if now >= next_tick:
+                    next_tick = now + self._tick_interval
+                    for ps in self._sockets:
+                        if not ps._tick_pending and ps._needs_tick():
+                            ps._tick_pending = True
+                            self._tasks.put((self._run_tick, ps))
+
+    def _unwatch(self, psocket):
+        """
+        Stop watching a socket for reading.
+        """
+        try:
+            self._selector.unregister(psocket.sock)
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def _worker(self):
+        """
+        Worker thread: run socket callbacks.
+        """
+        while True:
+            callback, ps = self._tasks.get()
+            try:
+                callback(ps)
+            except Exception:
+                logging.exception(f"Reactor: {callback.__name__} failed")
+
+    def _run_send(self, psocket):
+        """
+        Run one send step, then reschedule the socket as it asks.
+        """
+        with self._lock:
+            psocket._send_state = _SEND_RUNNING
+            psocket._send_again = False
+        delay = None
+        try:
+            delay = psocket._send_step()
+        finally:
+            with self._lock:
+                if delay is None and psocket._send_again:
+                    delay = 0
+                if delay is None:
+                    psocket._send_state = _SEND_IDLE
+                elif delay <= 0:
+                    # Back of the queue, so busy sockets take turns
+                    psocket._send_state = _SEND_QUEUED
+                    self._tasks.put((self._run_send, psocket))
+                else:
+                    psocket._send_state = _SEND_WAITING
+                    self._timer_seq += 1
+                    heapq.heappush(
+                        self._timers,
+                        (time.monotonic() + delay, self._timer_seq, psocket),
+                    )
+            if delay is not None and delay > 0:
+                self._wakeup()
+
+    def _run_readable(self, psocket):
+        """
+        Drain a readable socket, then watch it again.
+        """
+        try:
+            psocket._on_readable()
+        finally:
+            with self._lock:
+                if psocket in self._sockets:
+                    self._arm.append(psocket)
+            self._wakeup()
+
+    def _run_tick(self, psocket):
+        """
+        Run the periodic work of a socket.
+        """
+        try:
+            if psocket in self._sockets:
+                psocket._tick()
+        finally:
+            psocket._tick_pending = False
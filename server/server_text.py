@@ -7,7 +7,9 @@ HOST_PORT = 5405
 
 
 def main():
-    with PerfectSocket((HOST_IP, HOST_PORT)) as ps:
+    with PerfectSocket(
+        (HOST_IP, HOST_PORT), trace_latency=True, clock_sync_interval=0.2
+    ) as ps:
         sent_times = []
         received_times = []
 
@@ -24,6 +26,9 @@ def main():
         print("first sent at", sent_times[0])
         print("last received at", received_times[-1])
         print("completed in", received_times[-1] - sent_times[0])
+        print("one-way latency (header timestamps):")
+        for name, value in ps.latency_histogram.summary().items():
+            print(f"  {name}: {value}")
 
 
 if __name__ == "__main__":
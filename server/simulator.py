@@ -0,0 +1,638 @@
+import copy
+import heapq
+import math
+import random
+import socket
+from collections import deque
+from concurrent.futures import Future
+
+from psocket import (
+    RCVBUF_PACKET_OVERHEAD,
+    SO_RCVBUFFORCE,
+    SO_RXQ_OVFL,
+    PerfectSocket,
+    _RXQ_OVFL_COUNTER,
+)
+
+# Wall clock (time.time) of a simulation at virtual time 0
+SIM_EPOCH = 1_700_000_000
+# Default SO_RCVBUF of simulated sockets, the Linux default
+SIM_RCVBUF = 212_992
+# First port given to sockets bound to port 0 (or not bound)
+SIM_EPHEMERAL_PORT = 32768
+
+
+class VirtualClock:
+    """
+    Virtual time of a SimNetwork, with the time module interface PerfectSocket and AimdController use.
+
+    Time only moves while the network runs, sleep and wait run it.
+    """
+
+    def __init__(self, network):
+        self._network = network
+        self.now_ns = 0
+
+    def time(self):
+        """
+        Virtual wall clock time in seconds, SIM_EPOCH at the start.
+        """
+        return SIM_EPOCH + self.now_ns / 1e9
+
+    def monotonic(self):
+        """
+        Virtual time in seconds since the start of the simulation.
+        """
+        return self.now_ns / 1e9
+
+    def monotonic_ns(self):
+        """
+        Virtual time in nanoseconds since the start of the simulation.
+        """
+        return self.now_ns
+
+    def sleep(self, seconds):
+        """
+        Run the network for seconds, or just move time on when called from a
+        simulation callback (like a blocking call stalls a reactor worker).
+        """
+        if self._network.running:
+            self.now_ns += max(0, round(seconds * 1e9))
+        else:
+            self._network.run(seconds)
+
+    def wait(self, condition, timeout=None):
+        """
+        Stand-in for condition.wait(timeout) of a blocking call: release the
+        condition and process the next network event due within timeout
+        seconds (or move time on to the timeout), the caller checks what it
+        waits for again.
+
+        Raises:
+            RuntimeError: Called from a simulation callback, or nothing left to run without a timeout, it would wait forever.
+        """
+        if self._network.running:
+            raise RuntimeError(
+                "VirtualClock: blocking call from a simulation callback, the network can't run until it returns."
+            )
+        condition.release()
+        try:
+            if not self._network._step(timeout):
+                raise RuntimeError(
+                    "VirtualClock: blocking call without a timeout on an idle network."
+                )
+        finally:
+            condition.acquire()
+
+
+class Link:
+    """
+    Seeded model of the path between two addresses.
+
+    Packets are lost at random (loss) or in bursts (Gilbert-Elliott model,
+    every packet is lost in the bad state), delayed by delay plus up to
+    jitter, and reordered by holding back a fraction of them. With a
+    bandwidth, the link is a bottleneck with a drop-tail queue of
+    queue_delay seconds.
+
+    A Link passed to SimNetwork is a template, each direction between two
+    addresses gets its own copy (state and random generator).
+    """
+
+    def __init__(
+        self,
+        loss=0.0,
+        burst=None,
+        delay=0.01,
+        jitter=0.0,
+        reorder=0.0,
+        reorder_delay=0.01,
+        bandwidth=None,
+        queue_delay=0.1,
+    ):
+        """
+        Initialize Link.
+
+        Args:
+            loss (float): Probability a packet is lost.
+            burst (tuple): (p_enter, p_leave) probabilities per packet to enter and leave the bad state, None for no bursts.
+            delay (float): One-way propagation delay in seconds.
+            jitter (float): Max extra delay in seconds, uniformly distributed.
+            reorder (float): Probability a packet is held back reorder_delay seconds.
+            reorder_delay (float): Extra delay of the reordered packets in seconds.
+            bandwidth (float): Bottleneck rate (bytes/sec), None for unlimited.
+            queue_delay (float): Max seconds of data queued at the bottleneck, the rest is dropped.
+        """
+        self.loss = loss
+        self.burst = burst
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.bandwidth = bandwidth
+        self.queue_delay = queue_delay
+
+        self.random = None  # Set per direction by SimNetwork
+        self._bad = False
+        self._busy_until = 0.0
+
+        # Statistics
+        self.stat_sent = 0
+        self.stat_lost = 0
+        self.stat_queue_drop = 0
+
+    def transit(self, size, now):
+        """
+        Decide the fate of a packet of size bytes sent at now.
+
+        Returns:
+            float: Seconds until it arrives, None if it is lost.
+        """
+        rng = self.random
+        self.stat_sent += 1
+        if self.burst:
+            p_enter, p_leave = self.burst
+            if rng.random() < (p_leave if self._bad else p_enter):
+                self._bad = not self._bad
+        if self._bad or (self.loss and rng.random() < self.loss):
+            self.stat_lost += 1
+            return None
+        delay = self.delay
+        if self.bandwidth:
+            start = max(now, self._busy_until)
+            if start - now > self.queue_delay:
+                self.stat_queue_drop += 1
+                return None
+            self._busy_until = start + size / self.bandwidth
+            delay += self._busy_until - now
+        if self.jitter:
+            delay += rng.uniform(0, self.jitter)
+        if self.reorder and rng.random() < self.reorder:
+            delay += self.reorder_delay
+        return delay
+
+
+class SimSocket:
+    """
+    In-memory datagram socket of a SimNetwork, with the part of the socket API PerfectSocket uses.
+
+    The receive buffer holds SO_RCVBUF bytes (counting RCVBUF_PACKET_OVERHEAD
+    per datagram like the kernel), datagrams arriving on a full buffer are
+    dropped and counted in SO_RXQ_OVFL.
+    """
+
+    def __init__(self, network, rcvbuf=SIM_RCVBUF):
+        self._network = network
+        self._addr = None
+        self._queue = deque()  # (data, src)
+        self._queued_bytes = 0
+        self._rcvbuf = rcvbuf
+        self._drops = 0
+        self._closed = False
+        self.on_readable = None  # Called when a datagram arrives, set by SimReactor
+
+    def bind(self, addr):
+        """
+        Like socket.bind, port 0 for the next free port.
+        """
+        self._addr = self._network._bind(self, addr)
+
+    def getsockname(self):
+        """
+        Like socket.getsockname, binds to a free port if not bound yet.
+        """
+        if self._addr is None:
+            self.bind(("127.0.0.1", 0))
+        return self._addr
+
+    def sendto(self, data, addr):
+        """
+        Like socket.sendto, the network decides whether and when it arrives.
+        """
+        if self._closed:
+            raise OSError("SimSocket: socket is closed.")
+        self._network._transmit(self.getsockname(), addr, bytes(data))
+        return len(data)
+
+    def recvfrom(self, bufsize, flags=0):
+        """
+        Like a non-blocking socket.recvfrom, raises BlockingIOError when empty.
+        """
+        if self._closed:
+            raise OSError("SimSocket: socket is closed.")
+        if not self._queue:
+            raise BlockingIOError
+        data, src = self._queue.popleft()
+        self._queued_bytes -= len(data) + RCVBUF_PACKET_OVERHEAD
+        return data[:bufsize], src
+
+    def recvmsg(self, bufsize, ancbufsize=0, flags=0):
+        """
+        Like socket.recvmsg, with the SO_RXQ_OVFL drop counter.
+        """
+        data, src = self.recvfrom(bufsize, flags)
+        ancdata = [
+            (socket.SOL_SOCKET, SO_RXQ_OVFL, _RXQ_OVFL_COUNTER.pack(self._drops))
+        ]
+        return data, ancdata, 0, src
+
+    def setsockopt(self, level, option, value):
+        """
+        Set SO_RCVBUF (SO_RCVBUFFORCE) or enable SO_RXQ_OVFL.
+        """
+        if option in (socket.SO_RCVBUF, SO_RCVBUFFORCE):
+            # Like Linux, keep twice the value for bookkeeping overhead
+            self._rcvbuf = min(2 * value, self._network.rmem_max or 2 * value)
+        elif option != SO_RXQ_OVFL:
+            raise OSError(f"SimSocket: unsupported option {option}.")
+
+    def getsockopt(self, level, option):
+        """
+        Get SO_RCVBUF.
+        """
+        if option == socket.SO_RCVBUF:
+            return self._rcvbuf
+        raise OSError(f"SimSocket: unsupported option {option}.")
+
+    def close(self):
+        """
+        Release the address.
+        """
+        if not self._closed:
+            self._closed = True
+            self._network._unbind(self)
+
+    def _deliver(self, data, src):
+        """
+        Network callback: queue an arriving datagram, or drop it on a full buffer.
+        """
+        size = len(data) + RCVBUF_PACKET_OVERHEAD
+        if self._queued_bytes + size > self._rcvbuf:
+            self._drops = (self._drops + 1) & 0xFFFFFFFF
+            self._network.stat_rcvbuf_drop += 1
+            return
+        self._queue.append((data, src))
+        self._queued_bytes += size
+        if self.on_readable:
+            self.on_readable()
+
+
+class SimReactor:
+    """
+    Reactor of a SimNetwork: runs the PerfectSocket callbacks (_send_step,
+    _on_readable, _tick) as events on the virtual clock, in the thread
+    running the network. Encode jobs run inline.
+    """
+
+    def __init__(self, network, tick_interval=0.01):
+        self._network = network
+        self._tick_interval = tick_interval
+        self._sockets = {}  # psocket -> None, in registration order
+        self._send_pending = {}  # psocket -> True when queued, False while paced
+        self._sending = None  # Socket whose send step is running
+        self._send_again = False  # Data queued during that step
+        self._read_pending = set()
+        self._ticking = False
+
+    def register(self, psocket):
+        """
+        Start handling a socket, and the periodic ticks on first use.
+        """
+        self._sockets[psocket] = None
+        psocket.sock.on_readable = lambda: self._readable(psocket)
+        if psocket.sock._queue:
+            self._readable(psocket)
+        if not self._ticking:
+            self._ticking = True
+            self._network.call_later(self._tick_interval, self._run_ticks)
+
+    def unregister(self, psocket):
+        """
+        Stop handling a socket.
+        """
+        self._sockets.pop(psocket, None)
+        psocket.sock.on_readable = None
+
+    def schedule_send(self, psocket):
+        """
+        Run the socket send step as the next event, after data was queued.
+        """
+        if psocket is self._sending:
+            # Called from the step itself (inline encode jobs), it reschedules
+            self._send_again = True
+            return
+        if psocket not in self._send_pending:
+            self._send_pending[psocket] = True
+            self._network.call_later(0, self._run_send, psocket)
+
+    def submit_encode(self, fn, *args):
+        """
+        Run fn(*args) right away.
+
+        Returns:
+            Future: Completed future of the call.
+        """
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _readable(self, psocket):
+        """
+        Drain the socket as the next event.
+        """
+        if psocket not in self._read_pending:
+            self._read_pending.add(psocket)
+            self._network.call_later(0, self._run_readable, psocket)
+
+    def _run_send(self, psocket):
+        """
+        Run one send step, then reschedule the socket as it asks.
+        """
+        del self._send_pending[psocket]
+        if psocket not in self._sockets:
+            return
+        self._sending, self._send_again = psocket, False
+        try:
+            delay = psocket._send_step()
+        finally:
+            self._sending = None
+        if delay is None and self._send_again:
+            delay = 0
+        if delay is None:
+            return
+        if delay <= 0:
+            self.schedule_send(psocket)
+            return
+        # Paced, data queued meanwhile waits for the timer
+        self._send_pending[psocket] = False
+        self._network.call_later(delay, self._run_send, psocket)
+
+    def _run_readable(self, psocket):
+        """
+        Drain a readable socket.
+        """
+        self._read_pending.discard(psocket)
+        if psocket in self._sockets:
+            psocket._on_readable()
+            if psocket.sock._queue:
+                self._readable(psocket)  # More than RECV_DRAIN_MAX queued
+
+    def _run_ticks(self):
+        """
+        Run the periodic work of every socket, until none is registered.
+        """
+        if not self._sockets:
+            self._ticking = False
+            return
+        for psocket in list(self._sockets):
+            if psocket in self._sockets and psocket._needs_tick():
+                psocket._tick()
+        self._network.call_later(self._tick_interval, self._run_ticks)
+
+
+class SimNetwork:
+    """
+    Deterministic in-memory network for PerfectSocket experiments.
+
+    Every node runs in one thread on a virtual clock: packets, reactor
+    callbacks and application events scheduled with call_at / call_later
+    are processed in time order, so hours of traffic take seconds and a
+    seed reproduces a run exactly. Sends never block in a simulation, the
+    sockets made by psocket() drop data on a full send queue by default.
+
+    Example:
+        net = SimNetwork(seed=1, link=Link(loss=0.05, delay=0.02))
+        rx = net.psocket(("10.0.0.2", 9000))
+        tx = net.psocket()
+        for i in range(1000):
+            net.call_at(i * 0.01, tx.sendto, b"x" * 1000, ("10.0.0.2", 9000))
+        net.run(20)
+        received = net.drain(rx)
+    """
+
+    def __init__(self, seed=0, link=None, rmem_max=None, tick_interval=0.01):
+        """
+        Initialize SimNetwork.
+
+        Args:
+            seed (int): Seed of every random generator of the simulation.
+            link (Link): Model of every path without a set_link one, None for a lossless 10 ms link.
+            rmem_max (int): Max SO_RCVBUF of the sockets (like net.core.rmem_max), None for unlimited.
+            tick_interval (float): Seconds between the periodic ticks of each PerfectSocket.
+        """
+        self.seed = seed
+        self.clock = VirtualClock(self)
+        self.reactor = SimReactor(self, tick_interval)
+        self.rmem_max = rmem_max
+        self.running = False
+        self._link = link or Link()
+        self._links = {}  # (src, dst) -> Link set with set_link or copied from link
+        self._sockets = {}  # addr -> SimSocket
+        self._next_port = SIM_EPHEMERAL_PORT
+        self._next_client_id = 0
+        self._events = []  # Heap of (due ns, seq, callback, args)
+        self._event_seq = 0
+
+        # Statistics
+        self.stat_unreachable = 0
+        self.stat_rcvbuf_drop = 0
+
+    def socket(self, bind_addr=None, rcvbuf=SIM_RCVBUF):
+        """
+        Create a SimSocket, bound to bind_addr if given.
+        """
+        sock = SimSocket(self, rcvbuf)
+        if bind_addr:
+            sock.bind(bind_addr)
+        return sock
+
+    def psocket(self, bind_addr=None, rcvbuf=SIM_RCVBUF, **kwargs):
+        """
+        Create a PerfectSocket on this network, kwargs are passed to PerfectSocket.
+        """
+        kwargs.setdefault("drop_if_full", True)
+        self._next_client_id += 1
+        psocket = PerfectSocket(
+            bind_addr,
+            transport=self.socket(rcvbuf=rcvbuf),
+            clock=self.clock,
+            reactor=self.reactor,
+            client_id=self._next_client_id,
+            **kwargs,
+        )
+        psocket._activate()  # Receive from the start, not from the first recvfrom
+        return psocket
+
+    def set_link(self, src, dst, link):
+        """
+        Use a model for the path from address src to address dst.
+        """
+        self._links[(src, dst)] = self._seeded(copy.copy(link), src, dst)
+
+    def link(self, src, dst):
+        """
+        Return the model (with its stats) of the path from src to dst.
+        """
+        link = self._links.get((src, dst))
+        if link is None:
+            link = self._links[(src, dst)] = self._seeded(
+                copy.copy(self._link), src, dst
+            )
+        return link
+
+    def call_at(self, when, callback, *args):
+        """
+        Run callback(*args) at virtual time when (seconds).
+        """
+        self._push(round(when * 1e9), callback, args)
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run callback(*args) in delay seconds of virtual time.
+        """
+        # Rounded up, a positive delay (pacing) must move time on
+        self._push(self.clock.now_ns + math.ceil(delay * 1e9), callback, args)
+
+    def _push(self, due, callback, args):
+        """
+        Add an event, not before now.
+        """
+        self._event_seq += 1
+        due = max(self.clock.now_ns, due)
+        heapq.heappush(self._events, (due, self._event_seq, callback, args))
+
+    def run(self, duration):
+        """
+        Process events for duration seconds of virtual time.
+        """
+        self.run_until(None, duration)
+
+    def run_until(self, predicate, timeout=None):
+        """
+        Process events until predicate() is true (checked after every event), or for timeout seconds.
+
+        Returns:
+            bool: Whether predicate() became true.
+        """
+        if self.running:
+            raise RuntimeError("SimNetwork: already running.")
+        end = None if timeout is None else self.clock.now_ns + round(timeout * 1e9)
+        self.running = True
+        try:
+            while self._events:
+                if predicate and predicate():
+                    return True
+                due, _, callback, args = self._events[0]
+                if end is not None and due > end:
+                    break
+                heapq.heappop(self._events)
+                self.clock.now_ns = max(self.clock.now_ns, due)
+                callback(*args)
+        finally:
+            self.running = False
+        if end is not None:
+            self.clock.now_ns = max(self.clock.now_ns, end)
+        return bool(predicate and predicate())
+
+    def _step(self, timeout):
+        """
+        Process the next event due within timeout seconds (None for any), otherwise move time on by timeout.
+
+        Returns:
+            bool: False if there was no event to process and no timeout.
+        """
+        if self.running:
+            raise RuntimeError("SimNetwork: already running.")
+        end = None if timeout is None else self.clock.now_ns + math.ceil(timeout * 1e9)
+        if not self._events or (end is not None and self._events[0][0] > end):
+            if end is None:
+                return False
+            self.clock.now_ns = max(self.clock.now_ns, end)
+            return True
+        due, _, callback, args = heapq.heappop(self._events)
+        self.clock.now_ns = max(self.clock.now_ns, due)
+        self.running = True
+        try:
+            callback(*args)
+        finally:
+            self.running = False
+        return True
+
+    def drain(self, psocket, stream_id=0):
+        """
+        Return every message received on a stream so far, as (data, addr), without blocking.
+        """
+        try:
+            return psocket.stream(stream_id).recvfrom_many(1 << 30, timeout=0)
+        except socket.timeout:
+            return []
+
+    def close(self, psocket, timeout=None):
+        """
+        Run the network until the socket sent everything queued (or for timeout seconds), then close it.
+        """
+        self.run_until(lambda: not psocket._unsent, timeout)
+        psocket.close(wait_queue=False)
+
+    def stats(self):
+        """
+        Return the network statistics as a dict, summed over every link.
+        """
+        links = self._links.values()
+        return {
+            "sent": sum(link.stat_sent for link in links),
+            "lost": sum(link.stat_lost for link in links),
+            "queue_drop": sum(link.stat_queue_drop for link in links),
+            "rcvbuf_drop": self.stat_rcvbuf_drop,
+            "unreachable": self.stat_unreachable,
+        }
+
+    def _seeded(self, link, src, dst):
+        """
+        Give a link copy its own random generator, so adding a path doesn't change the others.
+        """
+        link.random = random.Random(f"{self.seed}:{src}:{dst}")
+        return link
+
+    def _bind(self, sock, addr):
+        """
+        Attach a socket to an address, port 0 for the next free one.
+        """
+        host, port = addr
+        if not port:
+            while (host, self._next_port) in self._sockets:
+                self._next_port += 1
+            port = self._next_port
+            self._next_port += 1
+        if (host, port) in self._sockets:
+            raise OSError(f"SimSocket: address {(host, port)} already in use.")
+        self._sockets[(host, port)] = sock
+        return (host, port)
+
+    def _unbind(self, sock):
+        """
+        Detach a closed socket from its address.
+        """
+        if sock._addr is not None and self._sockets.get(sock._addr) is sock:
+            del self._sockets[sock._addr]
+
+    def _transmit(self, src, dst, data):
+        """
+        Send a datagram through the link model of its path.
+        """
+        delay = self.link(src, dst).transit(len(data), self.clock.monotonic())
+        if delay is not None:
+            self.call_later(delay, self._deliver, src, dst, data)
+
+    def _deliver(self, src, dst, data):
+        """
+        Hand an arriving datagram to the socket bound to dst.
+        """
+        sock = self._sockets.get(dst)
+        if sock is None:
+            self.stat_unreachable += 1
+            return
+        sock._deliver(data, src)
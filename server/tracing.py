@@ -0,0 +1,180 @@
+import bisect
+import threading
+from collections import OrderedDict, deque
+
+# Profiling hook stages, in pipeline order
+STAGE_ENQUEUE = "enqueue"
+STAGE_ENCODE_START = "encode_start"
+STAGE_ENCODE_END = "encode_end"
+STAGE_FIRST_OUT = "first_fragment_out"
+STAGE_LAST_OUT = "last_fragment_out"
+STAGE_FIRST_IN = "first_fragment_in"
+STAGE_DECODE_START = "decode_start"
+STAGE_DECODE_END = "decode_end"
+STAGE_DELIVER = "deliver"
+
+SENDER_STAGES = (
+    STAGE_ENQUEUE,
+    STAGE_ENCODE_START,
+    STAGE_ENCODE_END,
+    STAGE_FIRST_OUT,
+    STAGE_LAST_OUT,
+)
+RECEIVER_STAGES = (
+    STAGE_FIRST_IN,
+    STAGE_DECODE_START,
+    STAGE_DECODE_END,
+    STAGE_DELIVER,
+)
+
+
+class LatencyHistogram:
+    """
+    Latency histogram with logarithmic buckets (4 per power of two, 1us to ~70min).
+    """
+
+    def __init__(self):
+        self._bounds = [1e-6 * 2 ** (i / 4) for i in range(4 * 32)]
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        """
+        Record a latency sample in seconds.
+        """
+        with self._lock:
+            self._counts[bisect.bisect_left(self._bounds, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.min = seconds if self.min is None else min(self.min, seconds)
+            self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, p):
+        """
+        Approximate p-th percentile (0-100) in seconds, the upper bound of its bucket.
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = p / 100 * self.count
+            seen = 0
+            for i, count in enumerate(self._counts):
+                seen += count
+                if seen >= rank and count:
+                    return self._bounds[i] if i < len(self._bounds) else self.max
+            return self.max
+
+    def summary(self):
+        """
+        Return count, mean, min, p50, p90, p99 and max as a dict (seconds).
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class ClockOffsetEstimator:
+    """
+    Estimate the offset of a peer monotonic clock from request / response probes (NTP style).
+
+    The sample with the smallest round trip time in the window is trusted,
+    since queueing delay on either path only makes it less accurate.
+    """
+
+    def __init__(self, window=16):
+        """
+        Initialize ClockOffsetEstimator.
+
+        Args:
+            window (int): Number of recent samples to keep.
+        """
+        self._samples = deque(maxlen=window)
+
+    def add_sample(self, t1, t2, t3):
+        """
+        Add a probe.
+
+        Args:
+            t1 (int): Local time the request was sent (ns).
+            t2 (int): Peer time the response was sent (ns).
+            t3 (int): Local time the response was received (ns).
+        """
+        rtt = t3 - t1
+        if rtt < 0:
+            return
+        self._samples.append((rtt, t2 - (t1 + t3) // 2))
+
+    @property
+    def offset(self):
+        """
+        Peer clock minus local clock (ns), None until a sample arrived.
+        """
+        if not self._samples:
+            return None
+        return min(self._samples)[1]
+
+    @property
+    def rtt(self):
+        """
+        Smallest round trip time in the window (ns), None until a sample arrived.
+        """
+        if not self._samples:
+            return None
+        return min(self._samples)[0]
+
+
+class StageProfiler:
+    """
+    Profiling hook aggregating the time spent between consecutive pipeline stages.
+
+    Pass an instance as PerfectSocket(profiler=...). The hook is called with
+    (stage, key, timestamp) where timestamp is time.monotonic() seconds.
+    """
+
+    def __init__(self, max_pending=10000):
+        """
+        Initialize StageProfiler.
+
+        Args:
+            max_pending (int): Max number of batches tracked at the same time.
+        """
+        self._max_pending = max_pending
+        self._pending = OrderedDict()  # key -> {stage: timestamp}
+        self._lock = threading.Lock()
+        self.histograms = {}  # "stage_a->stage_b" -> LatencyHistogram
+
+    def __call__(self, stage, key, timestamp):
+        with self._lock:
+            stages = self._pending.get(key)
+            if stages is None:
+                stages = self._pending[key] = {}
+                while len(self._pending) > self._max_pending:
+                    self._pending.popitem(last=False)
+            stages.setdefault(stage, timestamp)
+            if stage not in (STAGE_LAST_OUT, STAGE_DELIVER):
+                return
+            del self._pending[key]
+            order = SENDER_STAGES if stage == STAGE_LAST_OUT else RECEIVER_STAGES
+            reached = [s for s in order if s in stages]
+            for a, b in zip(reached, reached[1:]):
+                name = f"{a}->{b}"
+                if name not in self.histograms:
+                    self.histograms[name] = LatencyHistogram()
+                self.histograms[name].add(stages[b] - stages[a])
+
+    def summary(self):
+        """
+        Return the summary of every stage transition histogram.
+        """
+        with self._lock:
+            return {name: h.summary() for name, h in self.histograms.items()}